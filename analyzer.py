@@ -1,21 +1,27 @@
 import csv
-from io import BytesIO, StringIO
+from io import BytesIO
+from functools import lru_cache
+from itertools import islice
 import math
+from typing import Iterator, Optional
 
+from config import ANALYSIS_BACKEND, ANALYSIS_NUMPY_MIN_PAGES, ANALYSIS_NUMPY_MIN_ROWS
+from dataset import ExerciseDataset, ExerciseStats, as_dataset
+from fast_analysis import HAS_NUMPY, calc_needed_per_page_np, stats_from_dataset_np
+from text_decoding import open_text
 
-def _decode_bytes(raw: bytes) -> str:
-    """Пытаемся декодировать байты с учётом типичных кодировок."""
-    for enc in ("utf-8", "utf-8-sig", "cp1251", "latin-1"):
-        try:
-            return raw.decode(enc)
-        except UnicodeDecodeError:
-            continue
-    # Последняя попытка — с заменой символов
-    return raw.decode("utf-8", errors="replace")
+REQUIRED_COLUMNS = {"instruction", "page_num", "pred_label"}
+
+# Сколько строк CSV разбирается за один шаг потокового чтения
+CSV_CHUNK_ROWS = 20000
 
 
+@lru_cache(maxsize=4096)
 def normalize_label(label: str) -> str:
-    """Нормализуем метку упражнения к каноническому виду."""
+    """
+    Нормализуем метку упражнения к каноническому виду.
+    Различных меток в файле единицы, поэтому результат кэшируется: на каждую строку — один поиск в словаре.
+    """
     if not label:
         return ""
     v = label.strip().lower()
@@ -27,36 +33,87 @@ def normalize_label(label: str) -> str:
     return v
 
 
-def parse_csv_bytes(raw: bytes) -> list[dict]:
-    """Парсим CSV из bytes в список словарей."""
-    text = _decode_bytes(raw)
-    reader = csv.DictReader(StringIO(text))
-    required = {"instruction", "page_num", "pred_label"}
-    if not reader.fieldnames:
-        raise ValueError("CSV пустой или не содержит заголовков.")
-    missing = required - set(fn.strip() for fn in reader.fieldnames)
-    if missing:
-        raise ValueError(f"В CSV отсутствуют столбцы: {', '.join(sorted(missing))}")
-
-    rows = []
-    for row in reader:
-        # Приводим ключи к ожидаемым
-        norm_row = {
-            "instruction": row.get("instruction", "").strip(),
-            "page_num": row.get("page_num", "").strip(),
-            "pred_label": normalize_label(row.get("pred_label", "")),
-        }
-        # Если есть дополнительные поля — сохраняем
-        if "unit" in row:
-            norm_row["unit"] = row.get("unit", "").strip()
-        if "module" in row:
-            norm_row["module"] = row.get("module", "").strip()
-        rows.append(norm_row)
-    return rows
-
-
-def parse_xlsx_bytes(raw: bytes) -> list[dict]:
-    """Parse XLSX bytes into a list of dicts."""
+class CsvIngest:
+    """
+    Потоковый разбор CSV: строки читаются порциями (step), сразу нормализуются и добавляются
+    в датасет, статистика датасета обновляется по ходу. В памяти — только текущая порция текста.
+    Строки без instruction и строки с лишними полями пропускаются и считаются
+    в dataset.invalid_rows; полностью пустые строки пропускаются молча (как в XLSX).
+    """
+
+    def __init__(self, source):
+        reader = csv.reader(open_text(source))
+        header = next(reader, None)
+        if not header:
+            raise ValueError("CSV пустой или не содержит заголовков.")
+        # Как в csv.DictReader: при повторяющихся заголовках берётся последний столбец
+        columns = {name.strip(): idx for idx, name in enumerate(header)}
+        missing = REQUIRED_COLUMNS - set(columns)
+        if missing:
+            raise ValueError(f"В CSV отсутствуют столбцы: {', '.join(sorted(missing))}")
+
+        self._width = len(header)
+        self._instruction_idx = columns["instruction"]
+        self._page_idx = columns["page_num"]
+        self._label_idx = columns["pred_label"]
+        self._unit_idx = columns.get("unit")
+        self._module_idx = columns.get("module")
+        self.dataset = ExerciseDataset(
+            has_unit=self._unit_idx is not None, has_module=self._module_idx is not None
+        )
+        # Пустая статистика создаётся сразу, дальше append обновляет её инкрементально
+        self.dataset.stats = ExerciseStats()
+        self.rows = 0
+        self.done = False
+        self._rows = self._iter_rows(reader)
+
+    def _iter_rows(self, reader) -> Iterator[tuple]:
+        """Нормализованные строки (instruction, page_num, pred_label, unit, module)."""
+        width = self._width
+
+        def cell(row: list[str], idx: Optional[int]) -> Optional[str]:
+            if idx is None:
+                return None
+            return row[idx].strip() if idx < len(row) else ""
+
+        for row in reader:
+            if not any(value.strip() for value in row):
+                continue
+            self.rows += 1
+            instruction = cell(row, self._instruction_idx)
+            if not instruction or len(row) > width:
+                self.dataset.invalid_rows += 1
+                continue
+            yield (
+                instruction,
+                cell(row, self._page_idx),
+                normalize_label(cell(row, self._label_idx)),
+                cell(row, self._unit_idx),
+                cell(row, self._module_idx),
+            )
+
+    def step(self, max_rows: int = CSV_CHUNK_ROWS) -> bool:
+        """Разбираем до max_rows строк; True — файл дочитан."""
+        append = self.dataset.append
+        consumed = 0
+        for row in islice(self._rows, max_rows):
+            append(*row)
+            consumed += 1
+        if consumed < max_rows:
+            self.done = True
+        return self.done
+
+
+def parse_csv_bytes(raw: bytes) -> ExerciseDataset:
+    """Парсим CSV из bytes в колоночный датасет (текст декодируется по мере чтения)."""
+    ingest = CsvIngest(raw)
+    while not ingest.step():
+        pass
+    return ingest.dataset
+
+
+def parse_xlsx_bytes(raw: bytes) -> ExerciseDataset:
+    """Parse XLSX bytes into a columnar dataset."""
     try:
         from openpyxl import load_workbook
     except ImportError as exc:
@@ -71,8 +128,9 @@ def parse_xlsx_bytes(raw: bytes) -> list[dict]:
 
     headers = [str(h).strip() if h is not None else "" for h in header_row]
     header_map = {h.lower(): idx for idx, h in enumerate(headers) if h}
-    required = {"instruction", "page_num", "pred_label"}
-    missing = required - set(header_map.keys())
+    # Ширина таблицы — до последнего непустого заголовка (openpyxl дополняет строки пустыми ячейками)
+    width = max(header_map.values()) + 1 if header_map else 0
+    missing = REQUIRED_COLUMNS - set(header_map.keys())
     if missing:
         raise ValueError(f"В XLSX отсутствуют столбцы: {', '.join(sorted(missing))}")
 
@@ -81,69 +139,58 @@ def parse_xlsx_bytes(raw: bytes) -> list[dict]:
             return ""
         return str(value).strip()
 
-    rows = []
+    instruction_idx = header_map["instruction"]
+    page_idx = header_map["page_num"]
+    label_idx = header_map["pred_label"]
+    unit_idx = header_map.get("unit")
+    module_idx = header_map.get("module")
+    dataset = ExerciseDataset(has_unit=unit_idx is not None, has_module=module_idx is not None)
     for row in rows_iter:
         if not row:
             continue
         if all(v is None or str(v).strip() == "" for v in row):
             continue
-        norm_row = {
-            "instruction": _cell_to_str(row[header_map["instruction"]]),
-            "page_num": _cell_to_str(row[header_map["page_num"]]),
-            "pred_label": normalize_label(_cell_to_str(row[header_map["pred_label"]])),
-        }
-        if "unit" in header_map:
-            norm_row["unit"] = _cell_to_str(row[header_map["unit"]])
-        if "module" in header_map:
-            norm_row["module"] = _cell_to_str(row[header_map["module"]])
-        rows.append(norm_row)
-
-    return rows
-
-
-def analyze_exercises(rows: list[dict]) -> dict:
-    """Считаем общую статистику и статистику по страницам."""
-    total = 0
-    communicative = 0
-    linguistic = 0
-    per_page: dict[int, dict] = {}
-
-    for row in rows:
-        total += 1
-        label = row.get("pred_label", "")
-        if label == "communicative":
-            communicative += 1
-        elif label == "linguistic":
-            linguistic += 1
-
-        # Нормализация номера страницы
-        page_raw = row.get("page_num", "")
-        try:
-            page = int(float(page_raw))
-        except (ValueError, TypeError):
-            # Если номер страницы некорректный, пропускаем пер-страничную статистику
+        # Те же правила, что и для CSV: без instruction или с данными за последним столбцом — пропускаем
+        instruction = _cell_to_str(row[instruction_idx])
+        if not instruction or any(_cell_to_str(v) for v in row[width:]):
+            dataset.invalid_rows += 1
             continue
-
-        if page not in per_page:
-            per_page[page] = {"total": 0, "communicative": 0, "linguistic": 0}
-        per_page[page]["total"] += 1
-        if label == "communicative":
-            per_page[page]["communicative"] += 1
-        elif label == "linguistic":
-            per_page[page]["linguistic"] += 1
-
-    ratio = (communicative / total) if total else 0.0
-    return {
-        "total": total,
-        "communicative": communicative,
-        "linguistic": linguistic,
-        "ratio": ratio,
-        "per_page": per_page,
-    }
+        dataset.append(
+            instruction,
+            _cell_to_str(row[page_idx]),
+            normalize_label(_cell_to_str(row[label_idx])),
+            _cell_to_str(row[unit_idx]) if unit_idx is not None else None,
+            _cell_to_str(row[module_idx]) if module_idx is not None else None,
+        )
+
+    return dataset
+
+
+def _use_numpy(size: int, min_size: int = ANALYSIS_NUMPY_MIN_ROWS) -> bool:
+    """Выбираем NumPy-путь по ANALYSIS_BACKEND и размеру данных (size строк или страниц против порога)."""
+    if ANALYSIS_BACKEND == "numpy":
+        return True
+    if ANALYSIS_BACKEND == "auto":
+        return HAS_NUMPY and size >= min_size
+    return False
+
+
+def analyze_exercises(rows) -> dict:
+    """
+    Считаем общую статистику и статистику по страницам (rows — ExerciseDataset или список словарей).
+    Для датасета берём его инкрементальную статистику: полный проход нужен только один раз
+    (на больших датасетах — по колонкам через NumPy, см. ANALYSIS_BACKEND).
+    """
+    dataset = as_dataset(rows)
+    if not dataset.has_stats and _use_numpy(len(dataset)):
+        dataset.stats = stats_from_dataset_np(dataset)
+    return dataset.stats.to_dict()
 
 
 def calc_needed_per_page(per_page: dict[int, dict], target_ratio: float = 0.5) -> dict[int, int]:
     """Для каждой страницы считаем, сколько коммуникативных упражнений нужно добавить."""
+    if target_ratio < 1 and _use_numpy(len(per_page), ANALYSIS_NUMPY_MIN_PAGES):
+        return calc_needed_per_page_np(per_page, target_ratio)
     needed: dict[int, int] = {}
     for page, stats in per_page.items():
         total = stats.get("total", 0)
@@ -161,8 +208,13 @@ def calc_needed_per_page(per_page: dict[int, dict], target_ratio: float = 0.5) -
     return needed
 
 
-def calc_needed_total(stats: dict, target_ratio: float = 0.5) -> int:
-    """Считаем, сколько коммуникативных нужно добавить для достижения целевого баланса."""
+def calc_needed_total(stats, target_ratio: float = 0.5) -> int:
+    """
+    Считаем, сколько коммуникативных нужно добавить для достижения целевого баланса.
+    stats — результат analyze_exercises или ExerciseStats датасета (читается без копирования).
+    """
+    if isinstance(stats, ExerciseStats):
+        stats = {"total": stats.total, "communicative": stats.communicative}
     total = stats.get("total", 0)
     communicative = stats.get("communicative", 0)
     if total == 0:
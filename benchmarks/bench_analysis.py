@@ -0,0 +1,77 @@
+"""
+Статистика датасета: Python (ExerciseStats.from_dataset) против NumPy (fast_analysis).
+
+    python benchmarks/bench_analysis.py --rows 10000 100000 500000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import analyzer  # noqa: E402
+from analyzer import calc_needed_per_page, normalize_label  # noqa: E402
+from dataset import ExerciseDataset, ExerciseStats  # noqa: E402
+from fast_analysis import HAS_NUMPY, calc_needed_per_page_np, stats_from_dataset_np  # noqa: E402
+
+RAW_LABELS = ["communicative", "Linguistic ", "коммуникативное", "языковое", "other"]
+
+
+def make_dataset(rows: int, seed: int = 0) -> ExerciseDataset:
+    """Корпус из нескольких книг: ~1000 страниц, 40 юнитов, 20 модулей."""
+    rng = random.Random(seed)
+    dataset = ExerciseDataset()
+    for _ in range(rows):
+        dataset.append(
+            "Read and say.",
+            str(rng.randint(1, 1000)),
+            normalize_label(rng.choice(RAW_LABELS)),
+            f"UNIT {rng.randint(1, 40)}",
+            f"Module {rng.randint(1, 20)}",
+        )
+    return dataset
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if not HAS_NUMPY:
+        print("numpy не установлен: сравнивать не с чем")
+        return
+    # Python-путь замеряем без переключения на NumPy внутри analyzer
+    analyzer.ANALYSIS_BACKEND = "python"
+
+    labels = [random.choice(RAW_LABELS) for _ in range(200_000)]
+    cached = best_of(lambda: [normalize_label(v) for v in labels], args.repeat)
+    uncached = best_of(lambda: [normalize_label.__wrapped__(v) for v in labels], args.repeat)
+    print(f"normalize_label x200k: {uncached * 1000:.1f} ms -> {cached * 1000:.1f} ms (кэш)")
+
+    print(f"{'rows':>9} {'python, ms':>11} {'numpy, ms':>10} {'speedup':>8} {'needed py/np, ms':>17}")
+    for rows in args.rows:
+        dataset = make_dataset(rows)
+        py = best_of(lambda: ExerciseStats.from_dataset(dataset), args.repeat)
+        fast = best_of(lambda: stats_from_dataset_np(dataset), args.repeat)
+        assert ExerciseStats.from_dataset(dataset).to_dict() == stats_from_dataset_np(dataset).to_dict()
+
+        per_page = ExerciseStats.from_dataset(dataset).per_page
+        needed_py = best_of(lambda: calc_needed_per_page(per_page, 0.6), args.repeat)
+        needed_np = best_of(lambda: calc_needed_per_page_np(per_page, 0.6), args.repeat)
+        needed = f"{needed_py * 1000:.2f}/{needed_np * 1000:.2f}"
+        print(f"{rows:>9} {py * 1000:>11.1f} {fast * 1000:>10.1f} {py / fast:>7.1f}x {needed:>17}")
+
+
+if __name__ == "__main__":
+    main()
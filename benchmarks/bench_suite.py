@@ -0,0 +1,343 @@
+"""
+Сквозной бенчмарк на синтетических учебниках: время и пик памяти (tracemalloc) по этапам обработки
+(parse_csv_bytes, parse_xlsx_bytes, parse_vocabulary, analyze_exercises, generate_exercises_local,
+build_xlsx_bytes) и полный путь загрузка -> /generate через диспетчер бота с локальной заменой
+Bot API (fake_bot_api.py) и LLM (mock_llm.py). Результат сохраняется в JSON для сравнения между коммитами.
+
+    python benchmarks/bench_suite.py --rows 1000 20000 200000 --output before.json
+    python benchmarks/bench_suite.py --rows 1000 20000 200000 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+API_PORT = 18081
+LLM_PORT = 18435
+
+# Настройки бота читаются при импорте config, поэтому задаём их до импорта модулей бота:
+# Bot API и LLM — локальные заглушки, без кэша ответов LLM и без файлов хранилища
+os.environ.update(
+    BOT_TOKEN="123456:BENCH",
+    TELEGRAM_API_SERVER=f"http://127.0.0.1:{API_PORT}",
+    LLM_PROVIDER="ollama",
+    LLM_PROVIDER_CHAIN="",
+    OLLAMA_ENDPOINT=f"http://127.0.0.1:{LLM_PORT}/api/generate",
+    LLM_CACHE_ENABLED="0",
+    FSM_STORAGE="memory",
+    METRICS_PORT="0",
+    TRACING_ENABLED="0",
+)
+sys.path.insert(0, str(ROOT))
+
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from aiohttp import web  # noqa: E402
+from openpyxl import Workbook  # noqa: E402
+
+import bot as bot_module  # noqa: E402
+from analyzer import analyze_exercises, calc_needed_total, parse_csv_bytes, parse_xlsx_bytes  # noqa: E402
+from bench_vocabulary import make_word_list  # noqa: E402
+from config import TARGET_COMMUNICATIVE_RATIO  # noqa: E402
+from cpu_executor import init_executors, shutdown_executors  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from generation_cache import close_cache  # noqa: E402
+from http_session import close_session, init_session  # noqa: E402
+from jobs import DONE, QUEUED, RUNNING, job_queue  # noqa: E402
+from llm_client import close_breakers  # noqa: E402
+from local_generator import generate_exercises_local  # noqa: E402
+from metrics import stage_seconds  # noqa: E402
+from mock_llm import MockLLM, start_mock_llm  # noqa: E402
+from vocabulary_parser import get_all_words, parse_vocabulary  # noqa: E402
+from xlsx_export import build_xlsx_bytes  # noqa: E402
+
+HEADER = ["instruction", "page_num", "pred_label", "unit", "module"]
+INSTRUCTIONS = ["Read and say.", "Listen and repeat.", "Look and match.", "Ask and answer.", "Sing the song."]
+LABELS = {"communicative": ["communicative", "коммуникативное"], "linguistic": ["Linguistic ", "языковое"]}
+
+
+def make_rows(rows: int, communicative_ratio: float = 0.3, seed: int = 0) -> list[tuple]:
+    """Корпус учебника: ~10 упражнений на страницу, 40 юнитов, 20 модулей, заданная доля коммуникативных."""
+    rng = random.Random(seed)
+    pages = max(1, rows // 10)
+    result = []
+    for _ in range(rows):
+        kind = "communicative" if rng.random() < communicative_ratio else "linguistic"
+        result.append((
+            rng.choice(INSTRUCTIONS),
+            str(rng.randint(1, pages)),
+            rng.choice(LABELS[kind]),
+            f"UNIT {rng.randint(1, 40)}",
+            f"Module {rng.randint(1, 20)}",
+        ))
+    return result
+
+
+def make_csv(rows: list[tuple]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def make_xlsx(rows: list[tuple]) -> bytes:
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def measure(func, repeat: int, setup=None, memory: bool = True) -> dict:
+    """
+    Лучшее и среднее время из repeat прогонов; пик памяти — отдельным прогоном под tracemalloc,
+    который заметно замедляет выполнение и в замер времени не попадает. setup() не замеряется.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    result = {"best_s": round(min(times), 6), "mean_s": round(sum(times) / len(times), 6)}
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_stages(args: argparse.Namespace) -> list[dict]:
+    results = []
+
+    def record(stage: str, rows: int, size: int, func, setup=None, **extra) -> None:
+        entry = {"stage": stage, "rows": rows, "input_bytes": size, **extra}
+        entry.update(measure(func, args.repeat, setup, memory=not args.no_memory))
+        results.append(entry)
+        peak = f"{entry['peak_mb']:9.1f} MB" if "peak_mb" in entry else ""
+        print(f"{stage:<26} {rows:>8} {entry['best_s'] * 1000:11.1f} ms {peak}")
+
+    text = make_word_list(args.vocab_kb * 1024)
+    raw_vocab = text.encode("utf-8")
+    vocab = parse_vocabulary(raw_vocab)
+    words = get_all_words(vocab)
+    record("parse_vocabulary", text.count("\n"), len(raw_vocab), lambda: parse_vocabulary(raw_vocab))
+
+    for rows in args.rows:
+        corpus = make_rows(rows, args.communicative_ratio)
+        raw_csv = make_csv(corpus)
+        raw_xlsx = make_xlsx(corpus)
+        del corpus
+
+        record("parse_csv_bytes", rows, len(raw_csv), lambda: parse_csv_bytes(raw_csv))
+        record("parse_xlsx_bytes", rows, len(raw_xlsx), lambda: parse_xlsx_bytes(raw_xlsx))
+
+        # Из XLSX датасет приходит без статистики: analyze_exercises делает полный проход
+        dataset = parse_xlsx_bytes(raw_xlsx)
+
+        def reset_stats() -> None:
+            dataset.stats = None
+
+        record("analyze_exercises", rows, 0, lambda: analyze_exercises(dataset), setup=reset_stats)
+
+        needed = calc_needed_total(analyze_exercises(dataset), TARGET_COMMUNICATIVE_RATIO)
+        record(
+            "generate_exercises_local", rows, 0, lambda: generate_exercises_local(needed, words), exercises=needed
+        )
+        record("build_xlsx_bytes", rows, 0, lambda: build_xlsx_bytes(dataset))
+    return results
+
+
+async def _user_flow(dp, bot, api: FakeBotAPI, chat_id: int, args: argparse.Namespace) -> dict:
+    """Загрузка файлов и /generate одного пользователя; файлы у каждого свои (без попаданий в upload_cache)."""
+    corpus = make_rows(args.flow_rows, args.communicative_ratio, seed=chat_id)
+    if args.flow_format == "xlsx":
+        data = make_xlsx(corpus)
+    else:
+        data = make_csv(corpus)
+    vocab = make_word_list(args.vocab_kb * 1024, seed=chat_id).encode("utf-8")
+
+    started = time.perf_counter()
+    await dp.feed_raw_update(bot, api.make_document_update(chat_id, f"book.{args.flow_format}", data))
+    await dp.feed_raw_update(bot, api.make_document_update(chat_id, "vocabulary.txt", vocab))
+    uploaded = time.perf_counter()
+    await dp.feed_raw_update(bot, api.make_update(chat_id, "/generate"))
+
+    owner = (chat_id, chat_id)
+    job = job_queue.get(owner)
+    while job is not None and job.state in {QUEUED, RUNNING}:
+        await asyncio.sleep(0.01)
+    finished = time.perf_counter()
+    return {
+        "upload_s": uploaded - started,
+        "generate_s": finished - uploaded,
+        "total_s": finished - started,
+        "state": job.state if job else None,
+        "error": job.error if job else None,
+    }
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 4)
+
+
+async def run_flow(args: argparse.Namespace) -> dict:
+    """Полный путь через диспетчер бота: документы и /generate от flow_users пользователей одновременно."""
+    api = FakeBotAPI()
+    api_runner = await _start_app(api.app(), API_PORT)
+    mock = MockLLM(args.llm_latency, args.llm_line_delay, args.llm_error_rate)
+    llm_runner = await start_mock_llm(mock, "127.0.0.1", LLM_PORT)
+
+    bot = bot_module.build_bot()
+    storage = MemoryStorage()
+    dp = bot_module.build_dispatcher(storage)
+    await init_session()
+    init_executors()
+    await job_queue.start()
+    try:
+        started = time.perf_counter()
+        users = await asyncio.wait_for(
+            asyncio.gather(*(_user_flow(dp, bot, api, chat_id, args) for chat_id in range(1, args.flow_users + 1))),
+            timeout=args.flow_timeout,
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await job_queue.stop()
+        await close_breakers()
+        await close_session()
+        shutdown_executors()
+        close_cache()
+        await storage.close()
+        await bot.session.close()
+        await llm_runner.cleanup()
+        await api_runner.cleanup()
+
+    stages = {
+        stage: {key: round(value, 4) for key, value in snapshot.items()}
+        for (stage,), snapshot in stage_seconds.snapshot().items()
+    }
+    result = {
+        "users": args.flow_users,
+        "rows": args.flow_rows,
+        "format": args.flow_format,
+        "llm_latency_s": args.llm_latency,
+        "llm_line_delay_s": args.llm_line_delay,
+        "wall_s": round(elapsed, 4),
+        "done": sum(1 for user in users if user["state"] == DONE),
+        "errors": [user["error"] for user in users if user["error"]],
+        "documents_sent": api.calls.get("sendDocument", 0),
+        "llm_requests": mock.requests,
+        "llm_errors": mock.errors,
+        # Сумма/количество/p50/p95 по этапам обработчиков (bot_stage_seconds) за весь прогон
+        "stages": stages,
+        # Пик RSS процесса за всё время бенчмарка (tracemalloc здесь не используется: искажает задержки)
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    for key in ("upload_s", "generate_s", "total_s"):
+        values = [user[key] for user in users]
+        result[key] = {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95), "max": round(max(values), 4)}
+    return result
+
+
+async def _start_app(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> None:
+    """Отношение текущего времени к базовому по каждому этапу и размеру; медленнее threshold — регрессия."""
+    base = {(entry["stage"], entry["rows"]): entry for entry in baseline.get("stages", [])}
+    print(f"\nСравнение с {baseline['meta'].get('commit')} (порог {threshold:.2f}x):")
+    for entry in current.get("stages", []):
+        old = base.get((entry["stage"], entry["rows"]))
+        if not old or not old["best_s"]:
+            continue
+        ratio = entry["best_s"] / old["best_s"]
+        memory = ""
+        if entry.get("peak_mb") and old.get("peak_mb"):
+            memory = f"  память {entry['peak_mb'] / old['peak_mb']:.2f}x"
+        mark = "  РЕГРЕССИЯ" if ratio > threshold else ""
+        print(f"{entry['stage']:<26} {entry['rows']:>8}  время {ratio:.2f}x{memory}{mark}")
+    old_flow, new_flow = baseline.get("flow"), current.get("flow")
+    if old_flow and new_flow and old_flow["total_s"]["p50"]:
+        ratio = new_flow["total_s"]["p50"] / old_flow["total_s"]["p50"]
+        mark = "  РЕГРЕССИЯ" if ratio > threshold else ""
+        print(f"{'flow total p50':<26} {new_flow['rows']:>8}  время {ratio:.2f}x{mark}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 20_000, 200_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--communicative-ratio", type=float, default=0.3)
+    parser.add_argument("--vocab-kb", type=int, default=64, help="размер синтетического вокабуляра, КБ")
+    parser.add_argument("--no-memory", action="store_true", help="без прогонов под tracemalloc")
+    parser.add_argument("--no-flow", action="store_true", help="только отдельные этапы")
+    parser.add_argument("--flow-users", type=int, default=4, help="пользователей одновременно")
+    parser.add_argument("--flow-rows", type=int, default=5_000)
+    parser.add_argument("--flow-format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--flow-timeout", type=float, default=600.0)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="задержка ответа mock LLM, с")
+    parser.add_argument("--llm-line-delay", type=float, default=0.0, help="пауза между строками ответа, с")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    result = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "stages": run_stages(args),
+    }
+    if not args.no_flow:
+        result["flow"] = asyncio.run(run_flow(args))
+        print(json.dumps(result["flow"], ensure_ascii=False, indent=2))
+
+    Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {args.output}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), result, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
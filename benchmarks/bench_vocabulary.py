@@ -0,0 +1,71 @@
+"""
+Пропускная способность parse_vocabulary на больших списках слов (серия учебников целиком).
+
+    python benchmarks/bench_vocabulary.py --mb 8 --repeat 3
+"""
+import argparse
+import io
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vocabulary_parser import parse_vocabulary  # noqa: E402
+
+WORDS = ["bed", "chair", "table", "teddy bear", "ball", "kite", "red", "happy", "look at", "jump"]
+TRANSLATIONS = ["кровать", "стул", "стол", "плюшевый мишка", "мяч", "воздушный змей", "красный"]
+
+
+def make_word_list(target_bytes: int, seed: int = 0) -> str:
+    """Синтетический вокабуляр в формате Spotlight: Module / Unit / 'word /phonetic/ перевод'."""
+    rng = random.Random(seed)
+    parts = ["Spotlight 2\n", "VOCABULARY\n"]
+    size = 0
+    book = module = unit = 0
+    while size < target_bytes:
+        if unit % 12 == 0:
+            book += 1
+            parts.append(f"-- PAGE {book} --\n")
+        if unit % 2 == 0:
+            module += 1
+            parts.append(f"Module {module}\n")
+        unit += 1
+        parts.append(f"Unit {unit}: Topic {unit}\n")
+        for _ in range(40):
+            word = rng.choice(WORDS)
+            line = f"{word} /{word.replace(' ', '')}/ {rng.choice(TRANSLATIONS)}\n"
+            parts.append(line)
+            size += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+def bench(label: str, func, size_mb: float, repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    units = len(result["order_units"])
+    print(f"{label:<12} {best * 1000:9.1f} ms  {size_mb / best:7.1f} MB/s  units={units}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, default=8.0, help="размер синтетического файла, МБ")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = make_word_list(int(args.mb * 1024 * 1024))
+    raw = text.encode("utf-8")
+    size_mb = len(raw) / (1024 * 1024)
+    print(f"input: {size_mb:.1f} MB, {text.count(chr(10))} lines")
+
+    bench("str", lambda: parse_vocabulary(text), size_mb, args.repeat)
+    bench("bytes", lambda: parse_vocabulary(raw), size_mb, args.repeat)
+    bench("file", lambda: parse_vocabulary(io.BytesIO(raw)), size_mb, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Локальная замена Bot API для прогона бота без Telegram: отвечает на методы, которые вызывает бот
+(getMe, sendMessage, editMessageText, getFile, ...), раздаёт обновления через getUpdates и шлёт их на вебхук.
+Замеряет задержку «обновление -> первый ответ бота в этот чат» и пропускную способность приёма.
+
+Бот запускается отдельно с адресом этого сервера:
+
+    TELEGRAM_API_SERVER=http://127.0.0.1:8081 BOT_TOKEN=123456:TEST FSM_STORAGE=memory \\
+        RUN_MODE=webhook WEBHOOK_PORT=8080 WEBHOOK_SECRET=s3cret python bot.py
+    python benchmarks/fake_bot_api.py --mode webhook --webhook-url http://127.0.0.1:8080/webhook \\
+        --secret s3cret --updates 2000
+
+Для сравнения с long polling — тот же бот с RUN_MODE=polling и --mode polling.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: ответы на методы бота, очередь getUpdates, журнал ответов по чатам."""
+
+    def __init__(self):
+        self.updates: asyncio.Queue[dict] = asyncio.Queue()
+        self.first_reply: dict[int, float] = {}
+        self.calls: dict[str, int] = {}
+        self.webhook: dict = {}
+        # file_path -> содержимое: документы из make_document_update, которые бот скачивает через getFile
+        self.files: dict[str, bytes] = {}
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+    def _user_message(self, chat_id: int) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+        }
+
+    def make_update(self, chat_id: int, text: str) -> dict:
+        message = self._user_message(chat_id)
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def make_document_update(self, chat_id: int, filename: str, data: bytes) -> dict:
+        """Обновление с документом; файл отдаётся боту по getFile и /file/bot<token>/<путь>."""
+        file_id = f"file{len(self.files) + 1}"
+        self.files[f"documents/{file_id}/{filename}"] = data
+        message = self._user_message(chat_id)
+        message["document"] = {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_name": filename,
+            "file_size": len(data),
+        }
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        self.first_reply.setdefault(chat_id, time.perf_counter())
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        timeout = float(params.get("timeout", 0) or 0)
+        batch: list[dict] = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout=timeout or 0.01))
+        except asyncio.TimeoutError:
+            return batch
+        limit = int(params.get("limit", 100) or 100)
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method in {"sendMessage", "editMessageText", "sendDocument"}:
+            result = self._message(params)
+        elif method == "getFile":
+            file_id = params.get("file_id", "")
+            path = next((path for path in self.files if path.split("/")[1] == file_id), None)
+            if path is None:
+                return web.json_response(
+                    {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}, status=400
+                )
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.files[path]),
+                "file_path": path,
+            }
+        elif method == "setWebhook":
+            self.webhook = {key: str(value) for key, value in params.items()}
+            result = True
+        else:
+            # deleteWebhook, deleteMessage, sendChatAction, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def download(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.download)
+        return app
+
+
+def report(api: FakeBotAPI, sent: dict[int, float], started: float, accepted: float) -> dict:
+    latencies = sorted(api.first_reply[chat] - at for chat, at in sent.items() if chat in api.first_reply)
+    finished = max(api.first_reply.values(), default=started)
+    result = {
+        "updates": len(sent),
+        "answered": len(latencies),
+        "intake_per_sec": round(len(sent) / max(accepted - started, 1e-9), 1),
+        "answered_per_sec": round(len(latencies) / max(finished - started, 1e-9), 1),
+    }
+    if latencies:
+        result["latency_ms"] = {
+            "p50": round(statistics.median(latencies) * 1000, 2),
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2),
+        }
+    return result
+
+
+async def drive(api: FakeBotAPI, args: argparse.Namespace) -> dict:
+    sent: dict[int, float] = {}
+    chats = range(1, args.updates + 1)
+    async with ClientSession() as session:
+        if args.mode == "webhook":
+            headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+            # Запрос с неверным секретом должен быть отклонён
+            async with session.post(
+                args.webhook_url,
+                json=api.make_update(0, "/start"),
+                headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+            ) as resp:
+                rejected = resp.status
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def post(chat_id: int) -> None:
+                async with semaphore:
+                    update = api.make_update(chat_id, args.text)
+                    sent[chat_id] = time.perf_counter()
+                    async with session.post(args.webhook_url, json=update, headers=headers) as resp:
+                        resp.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(chat_id) for chat_id in chats))
+            accepted = time.perf_counter()
+        else:
+            rejected = None
+            started = time.perf_counter()
+            for chat_id in chats:
+                sent[chat_id] = time.perf_counter()
+                api.updates.put_nowait(api.make_update(chat_id, args.text))
+            # Приём завершён, когда бот забрал все обновления из очереди getUpdates
+            while not api.updates.empty():
+                await asyncio.sleep(0.001)
+            accepted = time.perf_counter()
+
+    deadline = time.perf_counter() + args.wait
+    while len(api.first_reply.keys() & sent.keys()) < len(sent) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    result = report(api, sent, started, accepted)
+    result["mode"] = args.mode
+    if rejected is not None:
+        result["wrong_secret_status"] = rejected
+    return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--mode", choices=["webhook", "polling", "serve"], default="serve",
+                        help="serve — только отвечать на запросы бота, без отправки обновлений")
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--text", default="/start")
+    parser.add_argument("--startup-delay", type=float, default=2.0,
+                        help="сколько секунд дать боту на запуск (polling) перед отправкой")
+    parser.add_argument("--wait", type=float, default=30.0, help="сколько ждать ответов бота")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Fake Bot API: http://{args.host}:{args.port}")
+    try:
+        if args.mode == "serve":
+            await asyncio.Event().wait()
+        await asyncio.sleep(args.startup_delay)
+        print(json.dumps(await drive(api, args), ensure_ascii=False, indent=2))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Локальная замена LLM с API Ollama (/api/generate, обычный и потоковый ответ) и настраиваемой задержкой.
+Количество упражнений берётся из промпта бота: «Создай N ...» или строки юнитов «[UNIT 1] — N упр.».
+
+    python benchmarks/mock_llm.py --port 11435 --latency 0.5 --line-delay 0.02
+    LLM_PROVIDER=ollama OLLAMA_ENDPOINT=http://127.0.0.1:11435/api/generate python bot.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+
+from aiohttp import web
+
+_COUNT_RE = re.compile(r"Создай (\d+)")
+_UNIT_RE = re.compile(r"^\[([^\]]+)\] — (\d+) упр\.", re.MULTILINE)
+
+TEMPLATES = [
+    'Покажи другу картинку и скажи: "I like my {word}."',
+    'Спроси друга: "Do you have a {word}?" Он/она отвечает: "Yes, I do / No, I don\'t".',
+    'Найди {word} в классе и скажи: "This is a {word}."',
+]
+
+
+def make_answer(prompt: str, rng: random.Random) -> str:
+    """Ответ в формате, который ожидает generation.py: нумерованные строки, для пачки — под метками юнитов."""
+    units = _UNIT_RE.findall(prompt)
+    if units:
+        blocks = [(f"[{unit}]", int(count)) for unit, count in units]
+    else:
+        match = _COUNT_RE.search(prompt)
+        blocks = [("", int(match.group(1)) if match else 3)]
+    lines = []
+    for tag, count in blocks:
+        if tag:
+            lines.append(tag)
+        for number in range(1, count + 1):
+            lines.append(f"{number}. " + rng.choice(TEMPLATES).format(word=f"word{rng.randint(1, 50)}"))
+    return "\n".join(lines) + "\n"
+
+
+class MockLLM:
+    """
+    latency — задержка до первого байта ответа, line_delay — пауза между строками потокового ответа,
+    error_rate — доля ответов 500 (бот повторяет такие запросы).
+    """
+
+    def __init__(self, latency: float = 0.5, line_delay: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.line_delay = line_delay
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text="mock error")
+        text = make_answer(payload.get("prompt", ""), self._rng)
+        if not payload.get("stream"):
+            if self.line_delay:
+                await asyncio.sleep(self.line_delay * text.count("\n"))
+            return web.json_response({"model": payload.get("model"), "response": text, "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for line in text.splitlines(keepends=True):
+            if self.line_delay:
+                await asyncio.sleep(self.line_delay)
+            await response.write(json.dumps({"response": line, "done": False}).encode("utf-8") + b"\n")
+        await response.write(json.dumps({"response": "", "done": True}).encode("utf-8") + b"\n")
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/generate", self.generate)
+        return app
+
+
+async def start_mock_llm(mock: MockLLM, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(mock.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка до ответа, с")
+    parser.add_argument("--line-delay", type=float, default=0.0, help="пауза между строками ответа, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    args = parser.parse_args()
+
+    runner = await start_mock_llm(MockLLM(args.latency, args.line_delay, args.error_rate), args.host, args.port)
+    print(f"Mock LLM (Ollama API): http://{args.host}:{args.port}/api/generate")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
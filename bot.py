@@ -1,28 +1,122 @@
 import asyncio
 import csv
+import os
+import signal
+from contextlib import contextmanager
 from io import BytesIO, StringIO
-from typing import List
+from typing import Any, Awaitable, Callable
 
-from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import BufferedInputFile, Message
+from aiogram.types import BufferedInputFile, FSInputFile, Message, TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from analyzer import CsvIngest, analyze_exercises, calc_needed_total, parse_csv_bytes, parse_xlsx_bytes
+from config import (
+    ADMIN_IDS,
+    BOT_TOKEN,
+    FSM_STORAGE,
+    METRICS_HOST,
+    METRICS_PORT,
+    RUN_MODE,
+    STATUS_EDIT_INTERVAL,
+    TARGET_COMMUNICATIVE_RATIO,
+    TELEGRAM_API_SERVER,
+    TRACING_ENABLED,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+    WEBHOOK_URL,
+)
+from cpu_executor import ExecutorBusyError, init_executors, run_cpu, shutdown_executors
+from dataset import ExerciseDataset, as_dataset
+from generation import GenerationProgress, generate_plan
+from generation_cache import close_cache, get_cache
+from http_session import close_session, init_session
+from jobs import DONE, FAILED, QUEUED, RUNNING, Job, JobRejected, job_queue
+from llm_client import close_breakers, hedge_counters, provider_health
+from metrics import (
+    CallbackMetric,
+    HandlerMetricsMiddleware,
+    format_report,
+    generations_total,
+    handle_metrics,
+    handler_seconds,
+    stage_seconds,
+    start_metrics_server,
+)
+from sqlite_storage import SQLiteStorage
+from supervisor import run_supervisor
+from tracing import Span, TracingMiddleware, close_tracing, current_span, span, trace
+from upload_cache import content_hash, upload_cache
+from vocabulary_parser import parse_vocabulary
+from xlsx_export import ExportResult, export_xlsx_pair
+
+
+@contextmanager
+def _stage(name: str):
+    """Этап обработки: гистограмма bot_stage_seconds и спан трейса с тем же именем."""
+    with stage_seconds.time(stage=name), span(name):
+        yield
+
+
+def _rows_size(rows: ExerciseDataset) -> int:
+    """Грубая оценка объёма строк в байтах для выбора пула."""
+    return len(rows) * 128
+
+
+def _input_file(result: ExportResult, filename: str):
+    """Файл для отправки: из памяти или с диска (если экспорт был записан во временный файл)."""
+    if isinstance(result, bytes):
+        return BufferedInputFile(result, filename=filename)
+    return FSInputFile(result, filename=filename)
+
+
+async def _export_xlsx(rows: ExerciseDataset, generated_start: int) -> tuple[ExportResult, ExportResult | None]:
+    """
+    Экспорт в пуле CPU-задач. Поток нельзя прервать, поэтому при отмене задачи ждать его
+    не будем, но файлы, которые он успеет записать, удалим.
+    Поток получает копию датасета: после отмены вызывающий код откатывает rows на месте,
+    а поток ещё может их читать.
+    """
+    snapshot = rows.copy()
+    export = asyncio.ensure_future(
+        run_cpu(export_xlsx_pair, snapshot, generated_start, size=_rows_size(snapshot))
+    )
+    try:
+        return await asyncio.shield(export)
+    except asyncio.CancelledError:
+        export.add_done_callback(_discard_export)
+        raise
 
-from analyzer import analyze_exercises, calc_needed_total, parse_csv_bytes, parse_xlsx_bytes
-from config import BOT_TOKEN, TARGET_COMMUNICATIVE_RATIO
-from llm_client import LLMError, generate_exercises
-from vocabulary_parser import get_all_words, get_words_for_unit, parse_vocabulary
 
+def _discard_export(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        _cleanup_export(*future.result())
 
-def _decode_bytes(raw: bytes) -> str:
-    """Декодируем текстовые файлы с учётом типичных кодировок."""
-    for enc in ("utf-8", "utf-8-sig", "cp1251", "latin-1"):
-        try:
-            return raw.decode(enc)
-        except UnicodeDecodeError:
-            continue
-    return raw.decode("utf-8", errors="replace")
+
+async def _delete_message(message: Message) -> None:
+    try:
+        await message.bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
+    except Exception:
+        pass
+
+
+def _cleanup_export(*results) -> None:
+    for result in results:
+        if isinstance(result, str):
+            try:
+                os.unlink(result)
+            except OSError:
+                pass
 
 
 def format_stats(stats: dict) -> str:
@@ -48,43 +142,6 @@ def format_stats(stats: dict) -> str:
     )
 
 
-def build_prompt(count: int, vocab_words: List[str]) -> str:
-    """Формируем промпт для генерации."""
-    vocab_str = ", ".join(vocab_words)
-    return (
-        "Ты опытный учитель английского языка для младших школьников. "
-        f"Создай {count} коммуникативных упражнений для развития говорения у детей 7-8 лет (уровень Pre-A1).\n\n"
-        f"ОБЯЗАТЕЛЬНАЯ ЛЕКСИКА: {vocab_str}\n\n"
-        "ТРЕБОВАНИЯ:\n"
-        "- Упражнения должны развивать ПРОДУКТИВНУЮ речь (не повторение и не аудирование)\n"
-        '- Используй визуальные опоры: "Посмотри на картинку...", "Покажи...", "Укажи на..."\n'
-        "- Фразы должны быть короткими: 35 слов максимум\n"
-        '- Добавь игровые элементы: "Давай поиграем", "Угадай, что у меня", "Поиграй с другом"\n'
-        "- Для каждого упражнения дай простой образец/стартер диалога\n"
-        "- Избегай письменных заданий — фокус только на устной речи\n"
-        "- Грамматика и лексика должны быть корректными\n"
-        "- Обязательно используй слова из ОБЯЗАТЕЛЬНОЙ ЛЕКСИКИ\n"
-        "- Каждое упражнение на отдельной строке, пронумеровано: 1., 2., 3.\n\n"
-        "ПРИМЕР ФОРМАТА:\n"
-        "1. Посмотри на картинку. Укажи на [игрушку] и скажи: \"I like my [teddy bear].\"\n"
-        "2. Спроси друга: \"Do you have a [ball]?\" Он/она отвечает: \"Yes, I do / No, I don't\".\n"
-        "3. Покажи свою любимую [игрушку] другу. Скажи 2 предложения: \"This is my... It is [big/small/red].\""
-    )
-
-
-def parse_generated_lines(text: str) -> List[str]:
-    """Разбираем ответ модели на список упражнений."""
-    lines = []
-    for raw_line in text.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
-        line = line.lstrip("0123456789.-) ")
-        if line:
-            lines.append(line)
-    return lines
-
-
 def build_csv_bytes(rows: list[dict]) -> bytes:
     """Собираем CSV из списка словарей."""
     output = StringIO()
@@ -99,28 +156,6 @@ def build_csv_bytes(rows: list[dict]) -> bytes:
     return output.getvalue().encode("utf-8")
 
 
-def build_xlsx_bytes(rows: list[dict]) -> bytes:
-    """Собираем XLSX из списка словарей."""
-    try:
-        from openpyxl import Workbook
-    except ImportError as exc:
-        raise RuntimeError("Для записи .xlsx нужен пакет openpyxl.") from exc
-
-    output = BytesIO()
-    has_unit = any("unit" in r for r in rows)
-    fieldnames = ["instruction", "page_num", "pred_label"]
-    if has_unit:
-        fieldnames.append("unit")
-
-    wb = Workbook()
-    ws = wb.active
-    ws.append(fieldnames)
-    for row in rows:
-        ws.append([row.get(k, "") for k in fieldnames])
-    wb.save(output)
-    return output.getvalue()
-
-
 def distribute_needed_across_units(needed_total: int, units: list[str]) -> dict:
     """Распределяем нужное количество упражнений по юнитам без ограничения 1-3."""
     if needed_total <= 0 or not units:
@@ -139,6 +174,30 @@ def distribute_needed_across_units(needed_total: int, units: list[str]) -> dict:
     return {u: c for u, c in plan.items() if c > 0}
 
 
+def format_progress(progress: GenerationProgress) -> str:
+    return (
+        "Идет обработка...\n"
+        f"Готово юнитов: {progress.units_done}/{progress.units_total}\n"
+        f"Упражнений получено: {progress.exercises}"
+    )
+
+
+async def report_progress(status_message: Message, progress: GenerationProgress) -> None:
+    """Периодически обновляем статусное сообщение (не чаще STATUS_EDIT_INTERVAL секунд)."""
+    last_text = status_message.text
+    while True:
+        await asyncio.sleep(STATUS_EDIT_INTERVAL)
+        text = format_progress(progress)
+        if text == last_text:
+            continue
+        try:
+            await status_message.edit_text(text)
+        except Exception:
+            # Ошибки правки (например, слишком частые запросы) не должны мешать генерации
+            continue
+        last_text = text
+
+
 async def download_document_bytes(bot: Bot, message: Message) -> bytes:
     """Скачиваем файл из Telegram в память."""
     document = message.document
@@ -164,7 +223,10 @@ async def on_start(message: Message):
         "4) Используй команду /generate , чтобы сгенерировать коммуникативные упражнения.\n\n"
         "Команды:\n"
         "/start  показать статистику\n"
-        "/generate  генерация упражнений"
+        "/generate  генерация упражнений\n"
+        "/generate nocache  генерация без кэша\n"
+        "/status  состояние генерации\n"
+        "/cancel  отменить генерацию"
     )
 
 
@@ -178,9 +240,83 @@ async def on_help(message: Message):
     )
 
 
-async def on_generate(message: Message, state: FSMContext):
+def _job_owner(message: Message) -> tuple[int, int]:
+    return message.chat.id, message.from_user.id if message.from_user else 0
+
+
+def format_job_status(job: Job | None) -> str:
+    if job is None:
+        return "Задач генерации нет. Используйте /generate."
+    if job.state == QUEUED:
+        return f"Задача в очереди: позиция {job_queue.position(job)} из {job_queue.queued}."
+    if job.state == RUNNING:
+        if job.progress is None:
+            return "Задача выполняется: подготовка данных."
+        return format_progress(job.progress)
+    if job.state == DONE:
+        return "Последняя генерация завершена."
+    if job.state == FAILED:
+        return f"Последняя генерация завершилась с ошибкой: {job.error}"
+    return "Последняя генерация отменена."
+
+
+async def on_generate(message: Message, state: FSMContext, command: CommandObject | None = None):
     data = await state.get_data()
-    rows = data.get("csv_rows")
+    if not data.get("csv_rows"):
+        await message.answer("Сначала загрузите CSV/XLSX файл.")
+        return
+    if not data.get("vocab"):
+        await message.answer("Сначала загрузите TXT с вокабуляром.")
+        return
+
+    # "/generate nocache" — сгенерировать заново, не используя кэш ответов
+    use_cache = not (command and command.args and "nocache" in command.args.lower())
+
+    # Генерация идёт в фоне: обработчик сразу освобождается, результат придёт отдельными сообщениями.
+    # Трейс обновления передаём задаче явно: она выполняется в контексте воркера очереди
+    parent = current_span()
+    try:
+        job = await job_queue.submit(
+            _job_owner(message), lambda job: run_generation(job, message, state, use_cache, parent)
+        )
+    except JobRejected as exc:
+        text = str(exc)
+        if exc.job is not None:
+            text += "\n" + format_job_status(exc.job)
+        await message.answer(text)
+        return
+
+    # Позиция считается сразу после постановки: задача ждёт, если впереди неё больше задач,
+    # чем свободных воркеров
+    position = job_queue.position(job)
+    if position > job_queue.workers - job_queue.running:
+        await message.answer(f"Задача поставлена в очередь: позиция {position}. Статус — /status.")
+
+
+async def on_status(message: Message):
+    await message.answer(format_job_status(job_queue.get(_job_owner(message))))
+
+
+async def run_generation(
+    job: Job, message: Message, state: FSMContext, use_cache: bool, parent: Span | None = None
+) -> None:
+    """Задача очереди: генерация по текущим данным пользователя и отправка результатов."""
+    try:
+        with handler_seconds.time(handler="run_generation"), trace("generation", parent=parent, job_id=job.id):
+            await _run_generation(job, message, state, use_cache)
+    except asyncio.CancelledError:
+        generations_total.inc(result="cancelled")
+        raise
+    except Exception as exc:
+        generations_total.inc(result="failed")
+        await message.answer(f"Ошибка генерации: {exc}")
+        raise
+    generations_total.inc(result="done")
+
+
+async def _run_generation(job: Job, message: Message, state: FSMContext, use_cache: bool) -> None:
+    data = await state.get_data()
+    rows = as_dataset(data.get("csv_rows"))
     vocab = data.get("vocab")
 
     if not rows:
@@ -190,7 +326,12 @@ async def on_generate(message: Message, state: FSMContext):
         await message.answer("Сначала загрузите TXT с вокабуляром.")
         return
 
-    stats_before = analyze_exercises(rows)
+    try:
+        with _stage("analyze"):
+            stats_before = await run_cpu(analyze_exercises, rows)
+    except ExecutorBusyError as exc:
+        await message.answer(str(exc))
+        return
     needed_total = calc_needed_total(stats_before, TARGET_COMMUNICATIVE_RATIO)
     if needed_total <= 0:
         await message.answer("Коммуникативных упражнений достаточно. Генерация не требуется.")
@@ -208,60 +349,59 @@ async def on_generate(message: Message, state: FSMContext):
 
     status_message = await message.answer("Идет обработка...")
 
-    new_rows = list(rows)
-    generated_rows: list[dict] = []
-    for unit, count in plan.items():
-        words = get_words_for_unit(vocab, unit)
-        if not words:
-            words = get_all_words(vocab, limit=30)
-
-        prompt = build_prompt(count, words)
-
-        try:
-            generated_text = await generate_exercises(prompt, count, words)
-        except LLMError as exc:
-            await message.answer(f"Ошибка генерации для {unit}: {exc}")
-            continue
-
-        lines = parse_generated_lines(generated_text)
-        if not lines:
-            await message.answer(f"Модель не вернула упражнения для {unit}.")
-            continue
+    progress = job.progress = GenerationProgress(len(plan))
+    progress_task = asyncio.create_task(report_progress(status_message, progress))
+    try:
+        with _stage("generate"):
+            results = await generate_plan(plan, vocab, use_cache=use_cache, progress=progress)
+    except asyncio.CancelledError:
+        # /cancel: запросы к LLM уже отменены вместе с задачей, XLSX не собираем
+        await _delete_message(status_message)
+        raise
+    finally:
+        progress_task.cancel()
+
+    for result in results:
+        if result["error"]:
+            await message.answer(result["error"])
+    # Удаляем сообщение о прогрессе
+    await _delete_message(status_message)
 
-        for line in lines[:count]:
-            row = {
-                "instruction": line,
-                "page_num": "",
-                "pred_label": "communicative",
-                "unit": unit,
-            }
-            new_rows.append(row)
-            generated_rows.append(row)
+    # Сгенерированные строки дописываем в тот же датасет: его статистика обновляется
+    # инкрементально, без копирования и повторного анализа всех строк
+    generated_start = len(rows)
+    had_unit = rows.has_unit
+    for result in results:
+        if not result["error"]:
+            for line in result["lines"]:
+                rows.append(line, "", "communicative", result["unit"])
 
-    stats_after = analyze_exercises(new_rows)
+    stats_after = analyze_exercises(rows)
 
-    # Удаляем сообщение о прогрессе
     try:
-        await message.bot.delete_message(chat_id=status_message.chat.id, message_id=status_message.message_id)
-    except Exception:
-        pass
-    try:
-        xlsx_bytes = build_xlsx_bytes(new_rows)
+        with _stage("xlsx"):
+            full_file, gen_file = await _export_xlsx(rows, generated_start)
+    except asyncio.CancelledError:
+        # Датасет общий с кэшем FSM-хранилища: при отмене возвращаем его к исходному виду
+        rows.truncate(generated_start)
+        rows.has_unit = had_unit
+        raise
     except Exception as exc:
+        rows.truncate(generated_start)
+        rows.has_unit = had_unit
         await message.answer(f"Ошибка формирования XLSX: {exc}")
         return
 
-    input_file = BufferedInputFile(xlsx_bytes, filename="balanced_exercises.xlsx")
-    await message.answer_document(input_file)
-
-    if generated_rows:
-        try:
-            gen_bytes = build_xlsx_bytes(generated_rows)
-        except Exception as exc:
-            await message.answer(f"Ошибка формирования XLSX (generated): {exc}")
-            return
-        gen_file = BufferedInputFile(gen_bytes, filename="generated_exercises.xlsx")
-        await message.answer_document(gen_file)
+    try:
+        # Датасет уже дополнен на месте (и лежит в кэше хранилища), поэтому запись не прерываем
+        # отменой: иначе сохранённые данные разойдутся с кэшем. Временные файлы удаляются в finally
+        await asyncio.shield(state.update_data(csv_rows=rows))
+        with _stage("upload"):
+            await message.answer_document(_input_file(full_file, "balanced_exercises.xlsx"))
+            if gen_file is not None:
+                await message.answer_document(_input_file(gen_file, "generated_exercises.xlsx"))
+    finally:
+        _cleanup_export(full_file, gen_file)
     msg = (
         "Статистика до/после:\n\n"
         "До:\n"
@@ -271,7 +411,59 @@ async def on_generate(message: Message, state: FSMContext):
     )
     await message.answer(msg)
 
-    await state.update_data(csv_rows=new_rows, stats=stats_after)
+
+async def on_cancel(message: Message):
+    job = job_queue.cancel(_job_owner(message))
+    if job is None:
+        await message.answer("Нет активной генерации.")
+        return
+    await message.answer("Генерация отменена.")
+
+
+async def on_stats(message: Message):
+    """Сводка метрик процесса — только для ADMIN_IDS (остальным команда не отвечает)."""
+    if not message.from_user or message.from_user.id not in ADMIN_IDS:
+        return
+    text = f"Метрики процесса {os.getpid()}:\n{format_report()}"
+    # Лимит длины сообщения Telegram
+    await message.answer(text[:4000])
+
+
+async def ingest_csv(message: Message, raw: bytes) -> CsvIngest:
+    """
+    Разбираем CSV порциями в пуле CPU-задач. Если разбор идёт дольше STATUS_EDIT_INTERVAL,
+    показываем и обновляем сообщение «Разобрано строк: N».
+    """
+    ingest = await run_cpu(CsvIngest, raw)
+    loop = asyncio.get_running_loop()
+    last_report = loop.time()
+    status_message = None
+    while not await run_cpu(ingest.step):
+        if loop.time() - last_report < STATUS_EDIT_INTERVAL:
+            continue
+        last_report = loop.time()
+        text = f"Разбираю CSV...\nРазобрано строк: {ingest.rows}"
+        try:
+            if status_message is None:
+                status_message = await message.answer(text)
+            else:
+                await status_message.edit_text(text)
+        except Exception:
+            pass
+    if status_message is not None:
+        try:
+            await status_message.delete()
+        except Exception:
+            pass
+    return ingest
+
+
+# Поддерживаемые загрузки: расширение -> (парсер, текст ошибки разбора)
+UPLOAD_PARSERS = {
+    "csv": (parse_csv_bytes, "Ошибка чтения CSV"),
+    "xlsx": (parse_xlsx_bytes, "Ошибка чтения XLSX"),
+    "txt": (parse_vocabulary, "Ошибка парсинга вокабуляра"),
+}
 
 
 async def on_document(message: Message, bot: Bot, state: FSMContext):
@@ -280,65 +472,248 @@ async def on_document(message: Message, bot: Bot, state: FSMContext):
         return
 
     filename = (document.file_name or "").lower()
-    try:
-        file_bytes = await download_document_bytes(bot, message)
-    except Exception as exc:
-        await message.answer(f"Не удалось скачать файл: {exc}")
+    kind = filename.rsplit(".", 1)[-1] if "." in filename else ""
+    if kind not in UPLOAD_PARSERS:
+        await message.answer("Поддерживаются только файлы CSV, XLSX и TXT.")
         return
 
-    if filename.endswith(".csv"):
+    # Уже известный файл (тот же file_unique_id) не скачиваем и не разбираем повторно
+    parsed = upload_cache.get_by_file_id(kind, document.file_unique_id)
+    if parsed is None:
         try:
-            rows = parse_csv_bytes(file_bytes)
+            with _stage("download"):
+                file_bytes = await download_document_bytes(bot, message)
         except Exception as exc:
-            await message.answer(f"Ошибка чтения CSV: {exc}")
+            await message.answer(f"Не удалось скачать файл: {exc}")
             return
-        await state.update_data(csv_rows=rows)
-        stats = analyze_exercises(rows)
-        await state.update_data(stats=stats)
-        await message.answer("CSV файл загружен.\n" + format_stats(stats))
-        return
 
-    if filename.endswith(".xlsx"):
+        parser, error_prefix = UPLOAD_PARSERS[kind]
         try:
-            rows = parse_xlsx_bytes(file_bytes)
-        except Exception as exc:
-            await message.answer(f"Ошибка чтения XLSX: {exc}")
+            digest = await run_cpu(content_hash, file_bytes)
+            parsed = upload_cache.get_by_hash(kind, digest, document.file_unique_id)
+            if parsed is None and kind == "csv":
+                # CSV разбирается потоково: прогресс для больших файлов, статистика по ходу разбора
+                with _stage("parse"):
+                    ingest = await ingest_csv(message, file_bytes)
+                parsed = ingest.dataset
+                upload_cache.put(kind, digest, parsed, len(file_bytes), document.file_unique_id)
+            elif parsed is None:
+                with _stage("parse"):
+                    parsed = await run_cpu(parser, file_bytes, size=len(file_bytes))
+                if isinstance(parsed, ExerciseDataset):
+                    # Статистика считается один раз и дальше хранится вместе с датасетом
+                    with _stage("analyze"):
+                        await run_cpu(analyze_exercises, parsed)
+                upload_cache.put(kind, digest, parsed, len(file_bytes), document.file_unique_id)
+        except ExecutorBusyError as exc:
+            await message.answer(str(exc))
             return
-        await state.update_data(csv_rows=rows)
-        stats = analyze_exercises(rows)
-        await state.update_data(stats=stats)
-        await message.answer("XLSX файл загружен.\n" + format_stats(stats))
-        return
-
-    if filename.endswith(".txt"):
-        text = _decode_bytes(file_bytes)
-        try:
-            vocab = parse_vocabulary(text)
         except Exception as exc:
-            await message.answer(f"Ошибка парсинга вокабуляра: {exc}")
+            await message.answer(f"{error_prefix}: {exc}")
             return
-        await state.update_data(vocab=vocab)
-        units_count = len(vocab.get("order_units", []))
+
+    if kind == "txt":
+        await state.update_data(vocab=parsed)
+        units_count = len(parsed.get("order_units", []))
         await message.answer(f"TXT файл загружен. Найдено юнитов: {units_count}.")
         return
 
-    await message.answer("Поддерживаются только файлы CSV, XLSX и TXT.")
+    await state.update_data(csv_rows=parsed)
+    stats = analyze_exercises(parsed)
+    msg = f"{kind.upper()} файл загружен.\n" + format_stats(stats)
+    if parsed.invalid_rows:
+        msg += f"\nПропущено некорректных строк (без instruction или с лишними полями): {parsed.invalid_rows}"
+    await message.answer(msg)
 
 
-async def main():
-    if not BOT_TOKEN:
-        raise RuntimeError("Не задан BOT_TOKEN в переменных окружения.")
+def build_storage() -> BaseStorage:
+    """Хранилище FSM по настройке FSM_STORAGE."""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "sqlite":
+        return SQLiteStorage()
+    raise RuntimeError(f"Неизвестное значение FSM_STORAGE: {FSM_STORAGE}")
+
 
-    bot = Bot(BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def build_bot() -> Bot:
+    """Бот с адресом Bot API из TELEGRAM_API_SERVER (если задан)."""
+    if not TELEGRAM_API_SERVER:
+        return Bot(BOT_TOKEN)
+    return Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)))
 
+
+def build_dispatcher(storage: BaseStorage) -> Dispatcher:
+    dp = Dispatcher(storage=storage)
+    if TRACING_ENABLED:
+        dp.update.outer_middleware(TracingMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
     dp.message.register(on_start, Command("start"))
     dp.message.register(on_help, Command("help"))
     dp.message.register(on_generate, Command("generate"))
+    dp.message.register(on_status, Command("status"))
+    dp.message.register(on_cancel, Command("cancel"))
+    dp.message.register(on_stats, Command("stats"))
     dp.message.register(on_document, F.document)
+    return dp
+
 
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    # getUpdates не работает, пока у бота установлен вебхук (например, после запуска в режиме webhook)
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 
+# Метрики, которые читаются из состояния процесса в момент выгрузки
+CallbackMetric("bot_jobs_queued", "Generation jobs waiting in the queue", lambda: job_queue.queued)
+CallbackMetric("bot_jobs_running", "Generation jobs being executed", lambda: job_queue.running)
+CallbackMetric(
+    "bot_llm_breaker_open",
+    "1 while the provider circuit breaker is open",
+    lambda: {name: int(item["state"] != "closed") for name, item in provider_health().items()},
+    labelnames=("provider",),
+)
+CallbackMetric(
+    "bot_llm_hedges_total", "Hedged LLM requests by outcome", hedge_counters, kind="counter", labelnames=("event",)
+)
+CallbackMetric(
+    "bot_upload_cache_total",
+    "Upload cache lookups",
+    lambda: {key: upload_cache.stats()[key] for key in ("hits", "misses")},
+    kind="counter",
+    labelnames=("result",),
+)
+
+
+def health_snapshot() -> dict:
+    """Состояние процесса для /health (в режиме supervisor его собирает супервизор)."""
+    return {
+        "pid": os.getpid(),
+        "jobs": {"queued": job_queue.queued, "running": job_queue.running},
+        "providers": provider_health(),
+        "hedging": hedge_counters(),
+        "upload_cache": upload_cache.stats(),
+    }
+
+
+async def on_health(request: web.Request) -> web.Response:
+    snapshot = health_snapshot()
+    # Попадания и промахи кэша ответов LLM (None — кэш отключён); размер кэша читается из SQLite
+    cache = get_cache()
+    snapshot["llm_cache"] = await cache.astats() if cache is not None else None
+    return web.json_response(snapshot)
+
+
+class InFlightUpdates(BaseMiddleware):
+    """
+    Задачи, которые сейчас обрабатывают обновления (outer-middleware dp.update).
+    При остановке webhook их дожидаемся, не полагаясь на внутренние поля SimpleRequestHandler.
+    """
+
+    def __init__(self):
+        self.tasks: set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self.tasks.discard(task)
+
+
+def _stop_event() -> asyncio.Event:
+    """Событие, которое выставляется по SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+    return stop
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+    """
+    Обновления приходят POST-запросами на WEBHOOK_PATH. Ответ Telegram отдаётся сразу,
+    а апдейт обрабатывается в фоне, поэтому медленный хендлер не задерживает приём следующих.
+    Запросы без верного секрета (WEBHOOK_SECRET) отклоняются с 401.
+    Остановка: перестаём принимать запросы, дожидаемся начатых апдейтов, затем закрываем сессию бота.
+    """
+    in_flight = InFlightUpdates()
+    dp.update.outer_middleware(in_flight)
+    app = web.Application()
+    handler = SimpleRequestHandler(dp, bot, secret_token=WEBHOOK_SECRET or None)
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", on_health)
+    app.router.add_get("/metrics", handle_metrics)
+    setup_application(app, dp, bot=bot)
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    try:
+        await _stop_event().wait()
+    finally:
+        await site.stop()
+        # Апдейты, принятые до остановки: даём только что созданным фоновым задачам дойти до middleware
+        await asyncio.sleep(0)
+        pending = list(in_flight.tasks)
+        if pending:
+            await asyncio.wait(pending, timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+        await runner.cleanup()
+
+
+async def main():
+    if not BOT_TOKEN:
+        raise RuntimeError("Не задан BOT_TOKEN в переменных окружения.")
+    if RUN_MODE not in {"polling", "webhook", "supervisor"}:
+        raise RuntimeError(f"Неизвестное значение RUN_MODE: {RUN_MODE}")
+
+    bot = build_bot()
+    if RUN_MODE == "supervisor":
+        # Обновления обрабатывают процессы-воркеры, здесь только приём и маршрутизация;
+        # диспетчер нужен, чтобы узнать типы обновлений для set_webhook
+        allowed_updates = build_dispatcher(MemoryStorage()).resolve_used_update_types()
+        await run_supervisor(bot, allowed_updates, _stop_event(), metrics_port=METRICS_PORT)
+        return
+    storage = build_storage()
+    dp = build_dispatcher(storage)
+
+    await init_session()
+    init_executors()
+    await job_queue.start()
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await job_queue.stop()
+        await close_breakers()
+        await close_session()
+        shutdown_executors()
+        close_cache()
+        close_tracing()
+        await storage.close()
+
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from config import LLM_BREAKER_FAILURES, LLM_BREAKER_PROBE_INTERVAL, LLM_BREAKER_SLOW_SECONDS
+
+CLOSED = "closed"
+OPEN = "open"
+
+# Фоновая проверка провайдера: корутина, которая завершается без исключения, если провайдер жив
+Probe = Callable[[], Awaitable[object]]
+
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера генерации.
+    После failure_threshold сбоев подряд (ошибка или ответ дольше slow_seconds) размыкается:
+    allow() сразу возвращает False, и запросы уходят следующему провайдеру цепочки без ожидания
+    ретраев. Пока предохранитель разомкнут, фоновая задача раз в probe_interval секунд
+    вызывает probe() и замыкает его после первой успешной и быстрой проверки.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        probe: Optional[Probe] = None,
+        failure_threshold: int = LLM_BREAKER_FAILURES,
+        slow_seconds: float = LLM_BREAKER_SLOW_SECONDS,
+        probe_interval: float = LLM_BREAKER_PROBE_INTERVAL,
+    ):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def allow(self) -> bool:
+        return self.state == CLOSED
+
+    def _is_slow(self, latency: float) -> bool:
+        return bool(self.slow_seconds) and latency > self.slow_seconds
+
+    def record_success(self, latency: float) -> None:
+        """Успешный ответ; слишком медленный считается сбоем (но результат используется)."""
+        if self._is_slow(latency):
+            self.record_failure()
+            return
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        if self.probe is not None and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop())
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+
+    async def _probe_loop(self) -> None:
+        while self.state == OPEN:
+            await asyncio.sleep(self.probe_interval)
+            started = time.monotonic()
+            try:
+                await self.probe()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                continue
+            if not self._is_slow(time.monotonic() - started):
+                self._close()
+
+    async def stop(self) -> None:
+        """Останавливаем фоновую проверку (при завершении бота)."""
+        task, self._probe_task = self._probe_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+        }
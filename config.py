@@ -10,6 +10,50 @@ load_dotenv(BASE_DIR / ".env")
 # Токен Telegram-бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Адрес Bot API (пусто — api.telegram.org); например, локальный telegram-bot-api сервер
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "").strip()
+
+# Режим получения обновлений: polling (long polling), webhook (aiohttp-сервер)
+# или supervisor (несколько процессов-воркеров за общим вебхуком)
+RUN_MODE = os.getenv("RUN_MODE", "polling").strip().lower()
+# Где слушает webhook-сервер
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip()
+# Публичный адрес (https://example.com), по которому Telegram достучится до сервера:
+# при старте бот регистрирует WEBHOOK_URL + WEBHOOK_PATH. Пусто — вебхук уже настроен снаружи
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token; запросы без него отклоняются
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+# Сколько секунд при остановке ждём обработки уже принятых обновлений
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))
+
+# Режим supervisor: столько процессов бота (по умолчанию — по числу ядер) слушают локальные порты
+# SUPERVISOR_BASE_PORT, SUPERVISOR_BASE_PORT + 1, ...; обновления раздаются им по chat_id
+SUPERVISOR_WORKERS = max(1, int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1))))
+SUPERVISOR_BASE_PORT = int(os.getenv("SUPERVISOR_BASE_PORT", "8100"))
+
+# Метрики в формате Prometheus: GET /metrics на отдельном порту (0 — отключено).
+# В режимах webhook и supervisor /metrics доступен и на порту вебхука
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Telegram id администраторов через запятую: им доступна команда /stats
+ADMIN_IDS = {int(value) for value in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if value}
+
+# Трассировка: трейс на каждое обновление (и фоновую генерацию) со вложенными спанами этапов
+# и попыток запросов к LLM; спаны дописываются в TRACE_PATH в формате JSON lines
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0").strip().lower() not in {"0", "false", "no", ""}
+TRACE_PATH = os.getenv("TRACE_PATH", str(BASE_DIR / "traces.jsonl"))
+# Доля обновлений, попадающих в трейсы
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+# Профилирование (при включённой трассировке): доля трейсов под профилировщиком; профиль
+# сохраняется в PROFILE_DIR, если запрос длился дольше PROFILE_THRESHOLD секунд (0 — отключено).
+# PROFILER: cprofile или pyinstrument (нужен пакет pyinstrument, иначе используется cProfile)
+PROFILE_THRESHOLD = float(os.getenv("PROFILE_THRESHOLD", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles"))
+PROFILER = os.getenv("PROFILER", "cprofile").strip().lower()
+
 # OpenRouter (Qwen via OpenRouter)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_ENDPOINT = os.getenv(
@@ -29,9 +73,101 @@ QWEN_MODEL = "qwen-turbo"
 # Провайдер генерации: openrouter / qwen / ollama / local (если не задан, выбирается автоматически)
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "").strip().lower()
 
+# Цепочка провайдеров через запятую, например "openrouter,ollama,local": при ошибке или открытом
+# предохранителе запрос уходит следующему. Если не задана — только провайдер из LLM_PROVIDER.
+LLM_PROVIDER_CHAIN = [
+    name.strip().lower() for name in os.getenv("LLM_PROVIDER_CHAIN", "").split(",") if name.strip()
+]
+# Предохранитель провайдера размыкается после стольких ошибок подряд
+LLM_BREAKER_FAILURES = max(1, int(os.getenv("LLM_BREAKER_FAILURES", "3")))
+# Ответ дольше стольких секунд считается сбоем (0 — не учитывать задержку)
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "30"))
+# Как часто фоновая проверка пробует разомкнутый провайдер
+LLM_BREAKER_PROBE_INTERVAL = float(os.getenv("LLM_BREAKER_PROBE_INTERVAL", "30"))
+
+# Лимиты исходящих запросов к провайдерам (общие для всех пользователей; 0 — без ограничения):
+# запросов в секунду и токенов в минуту. Ответ 429 с Retry-After приостанавливает все запросы к провайдеру.
+OPENROUTER_RPS = float(os.getenv("OPENROUTER_RPS", "0"))
+OPENROUTER_TPM = float(os.getenv("OPENROUTER_TPM", "0"))
+QWEN_RPS = float(os.getenv("QWEN_RPS", "0"))
+QWEN_TPM = float(os.getenv("QWEN_TPM", "0"))
+OLLAMA_RPS = float(os.getenv("OLLAMA_RPS", "0"))
+
+# Хеджирование: если провайдер не ответил за перцентиль LLM_HEDGE_PERCENTILE своих недавних задержек,
+# тот же промпт отправляется следующему провайдеру цепочки; берётся первый ответ.
+# Пока замеров меньше LLM_HEDGE_MIN_SAMPLES, ждём LLM_HEDGE_DEFAULT_DELAY секунд.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0").strip().lower() not in {"0", "false", "no", ""}
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "15"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
 # Настройки Ollama (локальный открытый инструмент)
 OLLAMA_ENDPOINT = os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434/api/generate")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
 
+# Температура генерации для OpenRouter и Qwen
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+
 # Целевой баланс коммуникативных упражнений
 TARGET_COMMUNICATIVE_RATIO = 0.5
+
+# Сколько юнитов генерируется одновременно (параллельные запросы к LLM)
+GENERATION_CONCURRENCY = max(1, int(os.getenv("GENERATION_CONCURRENCY", "4")))
+
+# Очередь /generate: сколько генераций выполняется одновременно (у каждой свои GENERATION_CONCURRENCY
+# запросов) и сколько задач может ждать в очереди
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "2")))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "50"))
+
+# Пакетная генерация: несколько юнитов в одном промпте (только для внешних LLM-провайдеров).
+# Размер пакета подбирается так, чтобы оценка токенов промпта и ответа укладывалась в бюджет.
+LLM_BATCH_ENABLED = os.getenv("LLM_BATCH_ENABLED", "1").strip().lower() not in {"0", "false", "no", ""}
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "3000"))
+LLM_BATCH_MAX_UNITS = max(1, int(os.getenv("LLM_BATCH_MAX_UNITS", "8")))
+
+# Потоковые ответы LLM: прогресс в статусном сообщении обновляется по мере генерации
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1").strip().lower() not in {"0", "false", "no", ""}
+# Минимальный интервал между правками статусного сообщения (лимиты Telegram на editMessageText)
+STATUS_EDIT_INTERVAL = float(os.getenv("STATUS_EDIT_INTERVAL", "1.5"))
+
+# Общий пул HTTP-соединений к LLM-провайдерам
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+
+# Дисковый кэш ответов LLM (SQLite): ключ — провайдер, модель, температура и хэш промпта
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").strip().lower() not in {"0", "false", "no", ""}
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(BASE_DIR / "llm_cache.sqlite3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+# Пул для CPU-задач (парсинг CSV/XLSX/TXT, сборка XLSX), чтобы не блокировать event loop
+EXECUTOR_THREADS = max(1, int(os.getenv("EXECUTOR_THREADS", "4")))
+# Процессный пул для больших файлов (0 — отключён)
+EXECUTOR_PROCESSES = int(os.getenv("EXECUTOR_PROCESSES", "0"))
+EXECUTOR_PROCESS_MIN_BYTES = int(os.getenv("EXECUTOR_PROCESS_MIN_MB", "5")) * 1024 * 1024
+# Сколько задач может ждать выполнения; сверх лимита пользователь получает «сервер занят»
+EXECUTOR_QUEUE_LIMIT = int(os.getenv("EXECUTOR_QUEUE_LIMIT", "32"))
+
+# Начиная с какого числа строк XLSX пишется во временный файл на диске, а не в память (0 — всегда в память)
+XLSX_SPOOL_ROWS = int(os.getenv("XLSX_SPOOL_ROWS", "20000"))
+
+# Хранилище FSM: sqlite (сессии на диске, переживают перезапуск) или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower()
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", str(BASE_DIR / "fsm_storage.sqlite3"))
+# Сессии без активности дольше FSM_TTL секунд удаляются
+FSM_TTL = int(os.getenv("FSM_TTL", str(7 * 24 * 3600)))
+# Сколько сессий держим в памяти в распакованном виде
+FSM_CACHE_SESSIONS = int(os.getenv("FSM_CACHE_SESSIONS", "32"))
+
+# Кэш разобранных загрузок (CSV/XLSX/TXT) в памяти: лимит по суммарному размеру исходных файлов
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+# Подсчёт статистики: python, numpy (нужен пакет numpy) или auto — numpy, если он установлен
+# и в датасете не меньше ANALYSIS_NUMPY_MIN_ROWS строк (для расчёта недостающих по страницам —
+# не меньше ANALYSIS_NUMPY_MIN_PAGES страниц)
+ANALYSIS_BACKEND = os.getenv("ANALYSIS_BACKEND", "auto").strip().lower()
+ANALYSIS_NUMPY_MIN_ROWS = int(os.getenv("ANALYSIS_NUMPY_MIN_ROWS", "1000"))
+ANALYSIS_NUMPY_MIN_PAGES = int(os.getenv("ANALYSIS_NUMPY_MIN_PAGES", "1000"))
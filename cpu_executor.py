@@ -0,0 +1,71 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config import (
+    EXECUTOR_PROCESS_MIN_BYTES,
+    EXECUTOR_PROCESSES,
+    EXECUTOR_QUEUE_LIMIT,
+    EXECUTOR_THREADS,
+)
+
+
+class ExecutorBusyError(Exception):
+    """Очередь CPU-задач переполнена."""
+
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+_pending = 0
+
+
+def init_executors() -> None:
+    """Создаём пулы: потоковый всегда, процессный — если EXECUTOR_PROCESSES > 0."""
+    global _thread_pool, _process_pool, _slots
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix="cpu")
+    if _process_pool is None and EXECUTOR_PROCESSES > 0:
+        _process_pool = ProcessPoolExecutor(max_workers=EXECUTOR_PROCESSES)
+    if _slots is None:
+        _slots = asyncio.Semaphore(EXECUTOR_THREADS + max(0, EXECUTOR_PROCESSES))
+
+
+def shutdown_executors() -> None:
+    global _thread_pool, _process_pool, _slots
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _thread_pool = None
+    _process_pool = None
+    _slots = None
+
+
+def _pick_pool(size: int) -> Executor:
+    if _process_pool is not None and size >= EXECUTOR_PROCESS_MIN_BYTES:
+        return _process_pool
+    return _thread_pool
+
+
+async def run_cpu(func: Callable[..., Any], *args, size: int = 0) -> Any:
+    """
+    Выполняем CPU-задачу вне event loop.
+    size — примерный объём входных данных в байтах: большие задачи уходят в процессный пул
+    (func и аргументы должны сериализоваться через pickle).
+    Если задач в очереди и в работе уже EXECUTOR_QUEUE_LIMIT, сразу бросаем ExecutorBusyError.
+    """
+    global _pending
+    if _thread_pool is None:
+        init_executors()
+    if _pending >= EXECUTOR_QUEUE_LIMIT:
+        raise ExecutorBusyError("Сервер сейчас занят обработкой файлов, попробуйте через минуту.")
+
+    _pending += 1
+    try:
+        async with _slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_pick_pool(size), functools.partial(func, *args))
+    finally:
+        _pending -= 1
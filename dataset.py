@@ -0,0 +1,356 @@
+from array import array
+from collections import Counter
+from typing import Iterable, Iterator, Optional
+
+# Номер страницы отсутствует или не распознан
+NO_PAGE = -(2**63)
+
+# Базовые метки получают фиксированные коды; прочие метки добавляются по мере появления
+BASE_LABELS = ("", "communicative", "linguistic")
+COMMUNICATIVE = 1
+LINGUISTIC = 2
+
+FIELDS = ("instruction", "page_num", "pred_label", "unit", "module")
+
+
+def parse_page(page_raw) -> int:
+    """Номер страницы как int (NO_PAGE, если не распознан)."""
+    try:
+        page = int(float(page_raw))
+    except (ValueError, TypeError, OverflowError):
+        return NO_PAGE
+    if not NO_PAGE < page < 2**63:
+        return NO_PAGE
+    return page
+
+
+def _empty_bucket() -> dict:
+    return {"total": 0, "communicative": 0, "linguistic": 0}
+
+
+def _bump(buckets: dict, key, label: int, delta: int) -> None:
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = _empty_bucket()
+    bucket["total"] += delta
+    if label == COMMUNICATIVE:
+        bucket["communicative"] += delta
+    elif label == LINGUISTIC:
+        bucket["linguistic"] += delta
+    if bucket["total"] <= 0:
+        del buckets[key]
+
+
+class ExerciseStats:
+    """
+    Инкрементальная статистика датасета: итоги, по страницам, по юнитам и по модулям.
+    add/remove обновляют счётчики за O(1), поэтому после добавления сгенерированных строк
+    статистику не нужно пересчитывать по всему датасету.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.communicative = 0
+        self.linguistic = 0
+        self.per_page: dict[int, dict] = {}
+        self.per_unit: dict[str, dict] = {}
+        self.per_module: dict[str, dict] = {}
+
+    def _apply(self, page: int, label: int, unit: str, module: str, delta: int) -> None:
+        self.total += delta
+        if label == COMMUNICATIVE:
+            self.communicative += delta
+        elif label == LINGUISTIC:
+            self.linguistic += delta
+        if page != NO_PAGE:
+            _bump(self.per_page, page, label, delta)
+        if unit:
+            _bump(self.per_unit, unit, label, delta)
+        if module:
+            _bump(self.per_module, module, label, delta)
+
+    def add(self, page: int, label: int, unit: str = "", module: str = "") -> None:
+        self._apply(page, label, unit, module, 1)
+
+    def remove(self, page: int, label: int, unit: str = "", module: str = "") -> None:
+        self._apply(page, label, unit, module, -1)
+
+    @classmethod
+    def from_dataset(cls, dataset) -> "ExerciseStats":
+        """Полный подсчёт за один проход по колонкам (нужен только при первом обращении)."""
+        stats = cls()
+        for (page, label), count in dataset.page_label_counts().items():
+            stats.total += count
+            if label == COMMUNICATIVE:
+                stats.communicative += count
+            elif label == LINGUISTIC:
+                stats.linguistic += count
+            if page != NO_PAGE:
+                bucket = stats.per_page.setdefault(page, _empty_bucket())
+                bucket["total"] += count
+                if label == COMMUNICATIVE:
+                    bucket["communicative"] += count
+                elif label == LINGUISTIC:
+                    bucket["linguistic"] += count
+        for attr, codes, table in (
+            ("per_unit", dataset.units, dataset.unit_table),
+            ("per_module", dataset.modules, dataset.module_table),
+        ):
+            buckets = getattr(stats, attr)
+            for (code, label), count in Counter(zip(codes, dataset.labels)).items():
+                name = table.names[code]
+                if not name:
+                    continue
+                bucket = buckets.setdefault(name, _empty_bucket())
+                bucket["total"] += count
+                if label == COMMUNICATIVE:
+                    bucket["communicative"] += count
+                elif label == LINGUISTIC:
+                    bucket["linguistic"] += count
+        return stats
+
+    def copy(self) -> "ExerciseStats":
+        clone = ExerciseStats()
+        clone.total = self.total
+        clone.communicative = self.communicative
+        clone.linguistic = self.linguistic
+        clone.per_page = {k: dict(v) for k, v in self.per_page.items()}
+        clone.per_unit = {k: dict(v) for k, v in self.per_unit.items()}
+        clone.per_module = {k: dict(v) for k, v in self.per_module.items()}
+        return clone
+
+    def to_dict(self) -> dict:
+        """Снимок в формате analyze_exercises (плюс per_unit и per_module)."""
+        snapshot = self.copy()
+        return {
+            "total": snapshot.total,
+            "communicative": snapshot.communicative,
+            "linguistic": snapshot.linguistic,
+            "ratio": (snapshot.communicative / snapshot.total) if snapshot.total else 0.0,
+            "per_page": snapshot.per_page,
+            "per_unit": snapshot.per_unit,
+            "per_module": snapshot.per_module,
+        }
+
+
+# Коды строк label/unit/module: 32 бита, чтобы не упираться в 65 535 разных значений в одном файле
+CODE_TYPECODE = "I"
+
+
+class _Interned:
+    """Таблица строк с кодами: одинаковые значения хранятся один раз."""
+
+    __slots__ = ("names", "codes")
+
+    def __init__(self, base: Iterable[str] = ("",)):
+        self.names: list[str] = list(base)
+        self.codes: dict[str, int] = {name: idx for idx, name in enumerate(self.names)}
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.names)
+            self.names.append(value)
+            self.codes[value] = code
+        return code
+
+    def copy(self) -> "_Interned":
+        clone = _Interned(())
+        clone.names = list(self.names)
+        clone.codes = dict(self.codes)
+        return clone
+
+
+class ExerciseDataset:
+    """
+    Колоночное хранение упражнений: параллельные массивы вместо списка словарей.
+    - instructions: список строк
+    - pages: номера страниц, уже разобранные в int (NO_PAGE — нет номера)
+    - labels / units / modules: коды строк из общих таблиц
+    Исходная строка page_num сохраняется отдельно только если она не совпадает с str(page),
+    поэтому экспорт возвращает номера страниц в исходном виде.
+    Статистика (stats) считается при первом обращении и дальше поддерживается при append/pop.
+    """
+
+    def __init__(self, has_unit: bool = False, has_module: bool = False):
+        self.has_unit = has_unit
+        self.has_module = has_module
+        self.instructions: list[str] = []
+        self.pages = array("q")
+        self.labels = array(CODE_TYPECODE)
+        self.units = array(CODE_TYPECODE)
+        self.modules = array(CODE_TYPECODE)
+        self.label_table = _Interned(BASE_LABELS)
+        self.unit_table = _Interned()
+        self.module_table = _Interned()
+        self._page_text: dict[int, str] = {}
+        self._stats: Optional[ExerciseStats] = None
+        # Строки загруженного файла, пропущенные при разборе (без instruction или с лишними полями)
+        self.invalid_rows = 0
+
+    def __setstate__(self, state: dict) -> None:
+        state.setdefault("_stats", None)
+        state.setdefault("invalid_rows", 0)
+        # Сессии, сохранённые до перехода на 32-битные коды
+        for name in ("labels", "units", "modules"):
+            if name in state and state[name].typecode != CODE_TYPECODE:
+                state[name] = array(CODE_TYPECODE, state[name])
+        self.__dict__.update(state)
+
+    @property
+    def stats(self) -> ExerciseStats:
+        if self._stats is None:
+            self._stats = ExerciseStats.from_dataset(self)
+        return self._stats
+
+    @stats.setter
+    def stats(self, value: ExerciseStats) -> None:
+        """Готовая статистика (например, посчитанная на NumPy); дальше она обновляется при append/pop."""
+        self._stats = value
+
+    @property
+    def has_stats(self) -> bool:
+        return self._stats is not None
+
+    def __len__(self) -> int:
+        return len(self.instructions)
+
+    def __bool__(self) -> bool:
+        return bool(self.instructions)
+
+    def append(
+        self,
+        instruction: str,
+        page_num: str,
+        pred_label: str,
+        unit: Optional[str] = None,
+        module: Optional[str] = None,
+    ) -> None:
+        """Добавляем строку (pred_label уже нормализован)."""
+        idx = len(self.instructions)
+        page = parse_page(page_num)
+        if page == NO_PAGE:
+            if page_num:
+                self._page_text[idx] = page_num
+        elif str(page) != page_num:
+            self._page_text[idx] = page_num
+        self.instructions.append(instruction)
+        self.pages.append(page)
+        self.labels.append(self.label_table.code(pred_label))
+        if unit is not None:
+            self.has_unit = True
+        if module is not None:
+            self.has_module = True
+        self.units.append(self.unit_table.code(unit or ""))
+        self.modules.append(self.module_table.code(module or ""))
+        if self._stats is not None:
+            self._stats.add(page, self.labels[-1], unit or "", module or "")
+
+    def pop(self) -> dict:
+        """Удаляем последнюю строку (статистика обновляется за O(1))."""
+        idx = len(self.instructions) - 1
+        if idx < 0:
+            raise IndexError("pop from empty dataset")
+        row = self.row(idx)
+        page = self.pages.pop()
+        label = self.labels.pop()
+        unit = self.unit_table.names[self.units.pop()]
+        module = self.module_table.names[self.modules.pop()]
+        self.instructions.pop()
+        self._page_text.pop(idx, None)
+        if self._stats is not None:
+            self._stats.remove(page, label, unit, module)
+        return row
+
+    def truncate(self, length: int) -> None:
+        """Откатываем датасет до length строк (например, если экспорт после генерации не удался)."""
+        while len(self.instructions) > length:
+            self.pop()
+
+    def page_text(self, idx: int) -> str:
+        text = self._page_text.get(idx)
+        if text is not None:
+            return text
+        page = self.pages[idx]
+        return "" if page == NO_PAGE else str(page)
+
+    def fieldnames(self) -> list[str]:
+        names = ["instruction", "page_num", "pred_label"]
+        if self.has_unit:
+            names.append("unit")
+        return names
+
+    def iter_values(self, fieldnames: Iterable[str], start: int = 0) -> Iterator[list[str]]:
+        """Строки как списки значений в порядке fieldnames (для экспорта)."""
+        getters = []
+        for name in fieldnames:
+            if name == "instruction":
+                getters.append(self.instructions.__getitem__)
+            elif name == "page_num":
+                getters.append(self.page_text)
+            elif name == "pred_label":
+                getters.append(lambda i: self.label_table.names[self.labels[i]])
+            elif name == "unit":
+                getters.append(lambda i: self.unit_table.names[self.units[i]])
+            elif name == "module":
+                getters.append(lambda i: self.module_table.names[self.modules[i]])
+            else:
+                getters.append(lambda i: "")
+        for idx in range(start, len(self.instructions)):
+            yield [get(idx) for get in getters]
+
+    def row(self, idx: int) -> dict:
+        row = {
+            "instruction": self.instructions[idx],
+            "page_num": self.page_text(idx),
+            "pred_label": self.label_table.names[self.labels[idx]],
+        }
+        if self.has_unit:
+            row["unit"] = self.unit_table.names[self.units[idx]]
+        if self.has_module:
+            row["module"] = self.module_table.names[self.modules[idx]]
+        return row
+
+    def __iter__(self) -> Iterator[dict]:
+        for idx in range(len(self.instructions)):
+            yield self.row(idx)
+
+    def page_label_counts(self) -> Counter:
+        """Counter {(page, label_code): n} за один проход по двум массивам."""
+        return Counter(zip(self.pages, self.labels))
+
+    def copy(self) -> "ExerciseDataset":
+        clone = ExerciseDataset(self.has_unit, self.has_module)
+        clone.instructions = list(self.instructions)
+        clone.pages = array("q", self.pages)
+        clone.labels = array(CODE_TYPECODE, self.labels)
+        clone.units = array(CODE_TYPECODE, self.units)
+        clone.modules = array(CODE_TYPECODE, self.modules)
+        clone.label_table = self.label_table.copy()
+        clone.unit_table = self.unit_table.copy()
+        clone.module_table = self.module_table.copy()
+        clone._page_text = dict(self._page_text)
+        clone._stats = self._stats.copy() if self._stats is not None else None
+        clone.invalid_rows = self.invalid_rows
+        return clone
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "ExerciseDataset":
+        """Собираем датасет из списка словарей (старый формат строк)."""
+        dataset = cls()
+        for row in rows:
+            dataset.append(
+                row.get("instruction", ""),
+                str(row.get("page_num", "") or ""),
+                row.get("pred_label", ""),
+                row.get("unit"),
+                row.get("module"),
+            )
+        return dataset
+
+
+def as_dataset(rows) -> Optional[ExerciseDataset]:
+    """Приводим данные из FSM (датасет или список словарей из старых сессий) к ExerciseDataset."""
+    if rows is None or isinstance(rows, ExerciseDataset):
+        return rows
+    return ExerciseDataset.from_rows(rows)
@@ -0,0 +1,95 @@
+from dataset import COMMUNICATIVE, LINGUISTIC, NO_PAGE, ExerciseDataset, ExerciseStats
+
+# Подсчёт статистики на NumPy: целые колонки датасета вместо цикла по строкам.
+# numpy — необязательная зависимость; без неё HAS_NUMPY = False и используется обычный путь.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("Для ANALYSIS_BACKEND=numpy нужен пакет numpy.")
+
+
+def _buckets(keys, total, communicative, linguistic) -> dict:
+    return {
+        key: {"total": t, "communicative": c, "linguistic": li}
+        for key, t, c, li in zip(keys, total.tolist(), communicative.tolist(), linguistic.tolist())
+    }
+
+
+def _grouped(codes, is_comm, is_ling, size: int):
+    total = np.bincount(codes, minlength=size)
+    communicative = np.bincount(codes[is_comm], minlength=size)
+    linguistic = np.bincount(codes[is_ling], minlength=size)
+    return total, communicative, linguistic
+
+
+def _per_table(codes_array, table, is_comm, is_ling) -> dict:
+    """Счётчики по кодам unit/module; пустое имя и коды без строк пропускаем."""
+    # dtype по typecode массива (C unsigned int — np.uintc)
+    codes = np.frombuffer(codes_array, dtype=codes_array.typecode)
+    total, communicative, linguistic = _grouped(codes, is_comm, is_ling, len(table.names))
+    # Коды выдаются по порядку первого появления, поэтому порядок ключей как в ExerciseStats
+    keep = np.flatnonzero(total)
+    keep = keep[keep != 0]  # код 0 — пустое значение
+    names = [table.names[code] for code in keep.tolist()]
+    return _buckets(names, total[keep], communicative[keep], linguistic[keep])
+
+
+def stats_from_dataset_np(dataset: ExerciseDataset) -> ExerciseStats:
+    """То же, что ExerciseStats.from_dataset, но через bincount по колонкам."""
+    _require_numpy()
+    stats = ExerciseStats()
+    if not len(dataset):
+        return stats
+
+    pages = np.frombuffer(dataset.pages, dtype=np.int64)
+    labels = np.frombuffer(dataset.labels, dtype=dataset.labels.typecode)
+    is_comm = labels == COMMUNICATIVE
+    is_ling = labels == LINGUISTIC
+
+    stats.total = int(len(labels))
+    stats.communicative = int(np.count_nonzero(is_comm))
+    stats.linguistic = int(np.count_nonzero(is_ling))
+
+    has_page = pages != NO_PAGE
+    page_values = pages[has_page]
+    if len(page_values):
+        unique, first, inverse = np.unique(page_values, return_index=True, return_inverse=True)
+        total, communicative, linguistic = _grouped(
+            inverse, is_comm[has_page], is_ling[has_page], len(unique)
+        )
+        # Страницы в порядке первого появления, как в Python-версии
+        order = np.argsort(first, kind="stable")
+        stats.per_page = _buckets(
+            unique[order].tolist(), total[order], communicative[order], linguistic[order]
+        )
+
+    stats.per_unit = _per_table(dataset.units, dataset.unit_table, is_comm, is_ling)
+    stats.per_module = _per_table(dataset.modules, dataset.module_table, is_comm, is_ling)
+    return stats
+
+
+def calc_needed_per_page_np(per_page: dict[int, dict], target_ratio: float = 0.5) -> dict[int, int]:
+    """Векторная версия calc_needed_per_page (тот же результат)."""
+    _require_numpy()
+    if not per_page:
+        return {}
+    size = len(per_page)
+    pages = np.fromiter(per_page.keys(), dtype=np.int64, count=size)
+    total = np.fromiter((s.get("total", 0) for s in per_page.values()), dtype=np.int64, count=size)
+    communicative = np.fromiter(
+        (s.get("communicative", 0) for s in per_page.values()), dtype=np.int64, count=size
+    )
+    if target_ratio == 0.5:
+        needed = total - 2 * communicative
+    else:
+        # int() в Python-версии отбрасывает дробную часть — здесь то же через trunc
+        needed = np.trunc((target_ratio * total - communicative) / (1 - target_ratio)).astype(np.int64)
+    keep = (total != 0) & (needed > 0)
+    return dict(zip(pages[keep].tolist(), needed[keep].tolist()))
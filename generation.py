@@ -0,0 +1,345 @@
+import asyncio
+import re
+from typing import List
+
+from config import (
+    GENERATION_CONCURRENCY,
+    LLM_BATCH_ENABLED,
+    LLM_BATCH_MAX_UNITS,
+    LLM_BATCH_TOKEN_BUDGET,
+    LLM_HEDGE_ENABLED,
+    LLM_STREAMING,
+)
+from llm_client import LLMError, generate_exercises, is_remote_provider, stream_exercises
+from rate_limiter import estimate_tokens
+from tracing import span
+from vocabulary_parser import get_all_words, get_words_for_unit
+
+
+_REQUIREMENTS = (
+    "ТРЕБОВАНИЯ:\n"
+    "- Упражнения должны развивать ПРОДУКТИВНУЮ речь (не повторение и не аудирование)\n"
+    '- Используй визуальные опоры: "Посмотри на картинку...", "Покажи...", "Укажи на..."\n'
+    "- Фразы должны быть короткими: 35 слов максимум\n"
+    '- Добавь игровые элементы: "Давай поиграем", "Угадай, что у меня", "Поиграй с другом"\n'
+    "- Для каждого упражнения дай простой образец/стартер диалога\n"
+    "- Избегай письменных заданий — фокус только на устной речи\n"
+    "- Грамматика и лексика должны быть корректными\n"
+)
+
+# Метка юнита в ответе пакетного промпта: "[UNIT 3]" (скобки и двоеточие модель иногда опускает)
+_UNIT_TAG_RE = re.compile(r"^\s*\[?\s*UNIT\s+(\d+)\s*\]?\s*:?\s*$", re.IGNORECASE)
+
+# Ожидаемая длина одного упражнения в ответе модели, в токенах
+_TOKENS_PER_EXERCISE = 60
+
+
+def build_prompt(count: int, vocab_words: List[str]) -> str:
+    """Формируем промпт для генерации."""
+    vocab_str = ", ".join(vocab_words)
+    return (
+        "Ты опытный учитель английского языка для младших школьников. "
+        f"Создай {count} коммуникативных упражнений для развития говорения у детей 7-8 лет (уровень Pre-A1).\n\n"
+        f"ОБЯЗАТЕЛЬНАЯ ЛЕКСИКА: {vocab_str}\n\n"
+        f"{_REQUIREMENTS}"
+        "- Обязательно используй слова из ОБЯЗАТЕЛЬНОЙ ЛЕКСИКИ\n"
+        "- Каждое упражнение на отдельной строке, пронумеровано: 1., 2., 3.\n\n"
+        "ПРИМЕР ФОРМАТА:\n"
+        "1. Посмотри на картинку. Укажи на [игрушку] и скажи: \"I like my [teddy bear].\"\n"
+        "2. Спроси друга: \"Do you have a [ball]?\" Он/она отвечает: \"Yes, I do / No, I don't\".\n"
+        "3. Покажи свою любимую [игрушку] другу. Скажи 2 предложения: \"This is my... It is [big/small/red].\""
+    )
+
+
+def build_batch_prompt(units: list[tuple[str, int, list[str]]]) -> str:
+    """Формируем один промпт для нескольких юнитов: [(unit, count, words), ...]."""
+    unit_lines = []
+    for unit, count, words in units:
+        unit_lines.append(f"[{unit}] — {count} упр. ОБЯЗАТЕЛЬНАЯ ЛЕКСИКА: {', '.join(words)}")
+    return (
+        "Ты опытный учитель английского языка для младших школьников. "
+        "Создай коммуникативные упражнения для развития говорения у детей 7-8 лет (уровень Pre-A1) "
+        "для каждого из юнитов ниже.\n\n"
+        "ЮНИТЫ:\n"
+        + "\n".join(unit_lines)
+        + "\n\n"
+        f"{_REQUIREMENTS}"
+        "- В упражнениях юнита используй только слова из ОБЯЗАТЕЛЬНОЙ ЛЕКСИКИ этого юнита\n"
+        "- Для каждого юнита создай ровно указанное количество упражнений\n\n"
+        "ФОРМАТ ОТВЕТА:\n"
+        "- Перед упражнениями юнита — отдельная строка с его меткой, например [UNIT 1]\n"
+        "- Под меткой каждое упражнение на отдельной строке, пронумеровано: 1., 2., 3.\n"
+        "- Никаких других заголовков и пояснений\n\n"
+        "ПРИМЕР ФОРМАТА:\n"
+        "[UNIT 1]\n"
+        "1. Посмотри на картинку. Укажи на [игрушку] и скажи: \"I like my [teddy bear].\"\n"
+        "2. Спроси друга: \"Do you have a [ball]?\" Он/она отвечает: \"Yes, I do / No, I don't\".\n"
+        "[UNIT 2]\n"
+        "1. Покажи свою любимую [игрушку] другу. Скажи 2 предложения: \"This is my... It is [big/small/red].\""
+    )
+
+
+def _clean_line(raw_line: str) -> str:
+    return raw_line.strip().lstrip("0123456789.-) ")
+
+
+def parse_generated_lines(text: str) -> List[str]:
+    """Разбираем ответ модели на список упражнений."""
+    lines = []
+    for raw_line in text.splitlines():
+        line = _clean_line(raw_line)
+        if line:
+            lines.append(line)
+    return lines
+
+
+def parse_batched_lines(text: str, units: list[str]) -> dict[str, list[str]]:
+    """
+    Разбираем ответ на пакетный промпт по меткам [UNIT N].
+    Возвращаем {unit: [упражнения]} только для юнитов из units; строки вне меток отбрасываются.
+    """
+    wanted = set(units)
+    result: dict[str, list[str]] = {}
+    current = None
+    for raw_line in text.splitlines():
+        tag = _UNIT_TAG_RE.match(raw_line)
+        if tag:
+            unit = f"UNIT {tag.group(1)}"
+            current = unit if unit in wanted else None
+            if current:
+                result.setdefault(current, [])
+            continue
+        if current is None:
+            continue
+        line = _clean_line(raw_line)
+        if line:
+            result[current].append(line)
+    return {unit: lines for unit, lines in result.items() if lines}
+
+
+class IncrementalLineParser:
+    """Собираем строки из потока фрагментов текста: feed() отдаёт только завершённые строки."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> list[str]:
+        self._buffer += chunk
+        if "\n" not in self._buffer:
+            return []
+        *complete, self._buffer = self._buffer.split("\n")
+        return complete
+
+    def close(self) -> list[str]:
+        tail, self._buffer = self._buffer, ""
+        return [tail] if tail else []
+
+
+def _is_exercise_line(raw_line: str) -> bool:
+    return bool(_clean_line(raw_line)) and not _UNIT_TAG_RE.match(raw_line)
+
+
+class GenerationProgress:
+    """Прогресс генерации для статусного сообщения: сколько юнитов готово и сколько упражнений получено."""
+
+    def __init__(self, units_total: int):
+        self.units_total = units_total
+        self.units_done = 0
+        self.exercises = 0
+
+    def unit_done(self, exercises: int) -> None:
+        self.units_done += 1
+        self.exercises += exercises
+
+
+def plan_batches(
+    plan: dict,
+    vocab: dict,
+    token_budget: int = LLM_BATCH_TOKEN_BUDGET,
+    max_units: int = LLM_BATCH_MAX_UNITS,
+) -> list[list[tuple[str, int, list[str]]]]:
+    """
+    Группируем юниты плана в пакеты по порядку.
+    В пакет добавляем юниты, пока оценка токенов промпта и ожидаемого ответа не превысит бюджет.
+    Юнит, который один не укладывается в бюджет, всё равно идёт отдельным пакетом.
+    """
+    base_tokens = estimate_tokens(build_batch_prompt([]))
+    batches: list[list[tuple[str, int, list[str]]]] = []
+    current: list[tuple[str, int, list[str]]] = []
+    current_tokens = base_tokens
+    for unit, count in plan.items():
+        words = _unit_words(vocab, unit)
+        unit_tokens = estimate_tokens(f"[{unit}] — {count} упр. {', '.join(words)}")
+        unit_tokens += count * _TOKENS_PER_EXERCISE
+        if current and (current_tokens + unit_tokens > token_budget or len(current) >= max_units):
+            batches.append(current)
+            current = []
+            current_tokens = base_tokens
+        current.append((unit, count, words))
+        current_tokens += unit_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _unit_words(vocab: dict, unit: str) -> list[str]:
+    words = get_words_for_unit(vocab, unit)
+    if not words:
+        words = get_all_words(vocab, limit=30)
+    return words
+
+
+async def _complete(
+    prompt: str,
+    count: int,
+    words: list[str],
+    use_cache: bool,
+    progress: GenerationProgress | None,
+    units: list[tuple[str, int, list[str]]] | None = None,
+) -> str:
+    """
+    Получаем ответ модели целиком. В потоковом режиме по мере прихода строк
+    увеличиваем progress.exercises; итоговое число упражнений учитывает вызывающий код.
+    units — юниты пакетного промпта: локальный шаблонный генератор отвечает по ним с метками.
+    """
+    # Хеджирование работает только для ответов целиком: поток от одного провайдера не переключить
+    if progress is None or not LLM_STREAMING or LLM_HEDGE_ENABLED:
+        return await generate_exercises(prompt, count, words, use_cache=use_cache, units=units)
+
+    parser = IncrementalLineParser()
+    chunks: list[str] = []
+    streamed = 0
+    try:
+        async for chunk in stream_exercises(prompt, count, words, use_cache=use_cache, units=units):
+            chunks.append(chunk)
+            for raw_line in parser.feed(chunk):
+                if _is_exercise_line(raw_line):
+                    streamed += 1
+                    progress.exercises += 1
+    finally:
+        # Предварительный счётчик снимаем: вызывающий код добавит окончательное число
+        progress.exercises -= streamed
+    return "".join(chunks)
+
+
+async def _generate_unit(
+    unit: str,
+    count: int,
+    words: list[str],
+    semaphore: asyncio.Semaphore,
+    use_cache: bool,
+    progress: GenerationProgress | None = None,
+) -> dict:
+    """Генерируем упражнения для одного юнита; ошибки возвращаем в результате, а не бросаем."""
+    result = {"unit": unit, "count": count, "lines": [], "error": None}
+    prompt = build_prompt(count, words)
+
+    async with semaphore:
+        try:
+            with span("generate.unit", unit=unit, count=count):
+                generated_text = await _complete(prompt, count, words, use_cache, progress)
+        except LLMError as exc:
+            result["error"] = f"Ошибка генерации для {unit}: {exc}"
+            _mark_done(progress, result)
+            return result
+
+    lines = parse_generated_lines(generated_text)
+    if not lines:
+        result["error"] = f"Модель не вернула упражнения для {unit}."
+    else:
+        result["lines"] = lines[:count]
+    _mark_done(progress, result)
+    return result
+
+
+def _mark_done(progress: GenerationProgress | None, result: dict) -> None:
+    if progress is not None:
+        progress.unit_done(len(result["lines"]))
+
+
+async def _generate_batch(
+    batch: list[tuple[str, int, list[str]]],
+    semaphore: asyncio.Semaphore,
+    use_cache: bool,
+    progress: GenerationProgress | None = None,
+) -> list[dict]:
+    """
+    Генерируем пакет юнитов одним запросом.
+    Юниты, которых нет в ответе модели, догенерируем по одному.
+    """
+    if len(batch) == 1:
+        unit, count, words = batch[0]
+        return [await _generate_unit(unit, count, words, semaphore, use_cache, progress)]
+
+    prompt = build_batch_prompt(batch)
+    total = sum(count for _, count, _ in batch)
+    all_words = [word for _, _, words in batch for word in words]
+    async with semaphore:
+        try:
+            with span("generate.batch", units=len(batch), count=total):
+                generated_text = await _complete(prompt, total, all_words, use_cache, progress, batch)
+        except LLMError as exc:
+            results = [
+                {"unit": unit, "count": count, "lines": [], "error": f"Ошибка генерации для {unit}: {exc}"}
+                for unit, count, _ in batch
+            ]
+            for result in results:
+                _mark_done(progress, result)
+            return results
+
+    per_unit = parse_batched_lines(generated_text, [unit for unit, _, _ in batch])
+    results: list = []
+    retries = []
+    for unit, count, words in batch:
+        lines = per_unit.get(unit)
+        if lines:
+            result = {"unit": unit, "count": count, "lines": lines[:count], "error": None}
+            _mark_done(progress, result)
+            results.append(result)
+        else:
+            retries.append(_generate_unit(unit, count, words, semaphore, use_cache, progress))
+            results.append(None)
+
+    if retries:
+        retried = iter(await asyncio.gather(*retries))
+        results = [r if r is not None else next(retried) for r in results]
+    return results
+
+
+async def generate_plan(
+    plan: dict,
+    vocab: dict,
+    concurrency: int = GENERATION_CONCURRENCY,
+    use_cache: bool = True,
+    batch: bool = LLM_BATCH_ENABLED,
+    progress: GenerationProgress | None = None,
+) -> list[dict]:
+    """
+    Запускаем генерацию для всех юнитов плана одновременно (не больше concurrency запросов сразу).
+    Результаты возвращаются в порядке плана (т.е. в порядке order_units):
+    [{"unit": "UNIT 1", "count": 2, "lines": [...], "error": None}, ...]
+    Ошибка одного юнита не отменяет остальные. use_cache=False — игнорировать кэш ответов LLM.
+    При batch=True и внешнем LLM-провайдере несколько юнитов упаковываются в один запрос.
+    Если передан progress, он обновляется по мере готовности юнитов (и строк при LLM_STREAMING).
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    if batch and is_remote_provider():
+        batches = plan_batches(plan, vocab)
+    else:
+        batches = [[(unit, count, _unit_words(vocab, unit))] for unit, count in plan.items()]
+
+    tasks = [_generate_batch(b, semaphore, use_cache, progress) for b in batches]
+    batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    by_unit: dict[str, dict] = {}
+    for b, results in zip(batches, batch_results):
+        if isinstance(results, asyncio.CancelledError):
+            raise results
+        if isinstance(results, Exception):
+            results = [
+                {"unit": unit, "count": count, "lines": [], "error": f"Ошибка генерации для {unit}: {results}"}
+                for unit, count, _ in b
+            ]
+        for result in results:
+            by_unit[result["unit"]] = result
+    return [by_unit[unit] for unit in plan]
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_MAX_BYTES, LLM_CACHE_PATH, LLM_CACHE_TTL
+
+
+def make_cache_key(provider: str, model: str, temperature: Optional[float], prompt: str) -> str:
+    """Ключ кэша: провайдер, модель, температура и хэш промпта."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    temp = "default" if temperature is None else f"{temperature:g}"
+    raw = f"{provider}\x00{model}\x00{temp}\x00{prompt_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    Дисковый кэш сгенерированных текстов в SQLite.
+    Вытеснение: записи старше ttl секунд удаляются, а при превышении max_bytes
+    удаляются давно не использованные записи.
+    """
+
+    def __init__(self, path: str, ttl: int = LLM_CACHE_TTL, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " key TEXT PRIMARY KEY,"
+            " provider TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS generations_last_access ON generations (last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, provider: str, model: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations"
+                " (key, provider, model, response, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl:
+            self._conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl,))
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Удаляем самые давно использованные записи, пока не уложимся в лимит
+        excess = total - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM generations ORDER BY last_access ASC"
+        ):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM generations WHERE key = ?", stale_keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, provider: str, model: str, response: str) -> None:
+        await asyncio.to_thread(self.put, key, provider, model, response)
+
+    async def astats(self) -> dict:
+        return await asyncio.to_thread(self.stats)
+
+
+_cache: Optional[GenerationCache] = None
+
+
+def get_cache() -> Optional[GenerationCache]:
+    """Общий кэш процесса (None, если кэш отключён через LLM_CACHE_ENABLED)."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = GenerationCache(LLM_CACHE_PATH)
+    return _cache
+
+
+def close_cache() -> None:
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
@@ -0,0 +1,106 @@
+import asyncio
+import math
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from config import (
+    LLM_HEDGE_DEFAULT_DELAY,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+)
+
+# Сколько последних успешных задержек провайдера учитываем
+_WINDOW_SIZE = 200
+
+
+class LatencyWindow:
+    """Скользящее окно задержек успешных ответов провайдера."""
+
+    def __init__(self, size: int = _WINDOW_SIZE):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Перцентиль методом nearest-rank (None, если замеров нет)."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+
+class HedgeStats:
+    """Сколько раз хедж отправлялся и сколько раз запасной провайдер ответил первым."""
+
+    def __init__(self):
+        self.fired = 0
+        self.won = 0
+
+    def snapshot(self) -> dict:
+        return {"fired": self.fired, "won": self.won}
+
+
+_latencies: dict[str, LatencyWindow] = {}
+hedge_stats = HedgeStats()
+
+
+def record_latency(provider: str, latency: float) -> None:
+    window = _latencies.get(provider)
+    if window is None:
+        window = _latencies[provider] = LatencyWindow()
+    window.add(latency)
+
+
+def hedge_delay(provider: str) -> float:
+    """Через сколько секунд без ответа отправлять хедж."""
+    window = _latencies.get(provider)
+    if window is None or len(window) < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(LLM_HEDGE_MIN_DELAY, window.percentile(LLM_HEDGE_PERCENTILE))
+
+
+async def hedged(
+    primary: Callable[[], Awaitable[str]],
+    secondary: Callable[[], Awaitable[str]],
+    delay: float,
+) -> str:
+    """
+    Запускаем primary; если он не завершился за delay секунд (или уже упал), запускаем secondary.
+    Возвращаем первый успешный результат, второй запрос отменяем.
+    Если упали оба — пробрасываем последнюю ошибку.
+    """
+    first = asyncio.ensure_future(primary())
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if first in done and first.exception() is None:
+            return first.result()
+        fired = first not in done
+        if fired:
+            hedge_stats.fired += 1
+        second = asyncio.ensure_future(secondary())
+        tasks.add(second)
+
+        pending = set(tasks) - done
+        error: Optional[BaseException] = first.exception() if first in done else None
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                if task.exception() is None:
+                    if task is second and fired:
+                        hedge_stats.won += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        losers = [task for task in tasks if not task.done()]
+        for task in losers:
+            task.cancel()
+        if losers:
+            await asyncio.gather(*losers, return_exceptions=True)
@@ -0,0 +1,71 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from config import (
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+)
+
+# Общая сессия процесса: создаётся в bot.main и закрывается при остановке
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _make_connector() -> aiohttp.TCPConnector:
+    return aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+    )
+
+
+async def init_session() -> aiohttp.ClientSession:
+    """Создаём общую HTTP-сессию с пулом соединений (повторный вызов возвращает ту же сессию)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=_make_connector())
+    return _session
+
+
+async def close_session() -> None:
+    """Закрываем общую HTTP-сессию и все соединения пула."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def get_session() -> Optional[aiohttp.ClientSession]:
+    """Возвращаем общую сессию, если она открыта."""
+    if _session is None or _session.closed:
+        return None
+    return _session
+
+
+@asynccontextmanager
+async def shared_session() -> AsyncIterator[aiohttp.ClientSession]:
+    """
+    Отдаём общую сессию, а если она не создана (например, клиент вызван вне бота) —
+    временную, которая закроется по выходу из блока.
+    """
+    session = get_session()
+    if session is not None:
+        yield session
+        return
+    async with aiohttp.ClientSession() as temp_session:
+        yield temp_session
+
+
+async def iter_sse_data(resp: aiohttp.ClientResponse) -> AsyncIterator[str]:
+    """Отдаём значения полей data: из ответа text/event-stream (комментарии пропускаем)."""
+    async for raw_line in resp.content:
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if not line or line.startswith(":"):
+            continue
+        if line.startswith("data:"):
+            yield line[5:].strip()
@@ -0,0 +1,183 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from config import JOB_QUEUE_LIMIT, JOB_WORKERS
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_ids = itertools.count(1)
+
+# Сколько помним завершённую задачу пользователя (для /status) и как часто чистим старые
+_FINISHED_TTL = 3600.0
+_PRUNE_INTERVAL = 60.0
+
+
+class JobRejected(Exception):
+    """Задачу нельзя поставить в очередь (у пользователя уже есть задача или очередь переполнена)."""
+
+    def __init__(self, message: str, job: Optional["Job"] = None):
+        super().__init__(message)
+        self.job = job
+
+
+class Job:
+    """Фоновая задача пользователя. progress заполняет сама задача (для /status)."""
+
+    def __init__(self, owner: Hashable, run: Callable[["Job"], Awaitable[None]]):
+        self.id = next(_ids)
+        self.owner = owner
+        self.run = run
+        self.state = QUEUED
+        self.progress: Any = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in (QUEUED, RUNNING)
+
+    def finish(self, state: str) -> None:
+        """
+        Завершаем задачу. run (замыкание с сообщением и FSM-контекстом пользователя) и task
+        больше не нужны — отпускаем их, чтобы /status не удерживал их в памяти.
+        """
+        self.state = state
+        self.finished_at = time.monotonic()
+        self.run = None
+        self.task = None
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач с пулом воркеров.
+    - у пользователя (owner) не больше одной активной задачи: повторный /generate не запускает
+      второй прогон над теми же данными;
+    - задачи выполняются по очереди поступления, одновременно — не больше workers;
+    - в очереди ждут не больше max_queued задач.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_LIMIT):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._pending: deque[Job] = deque()
+        self._jobs: dict[Hashable, Job] = {}
+        self._wakeup = asyncio.Condition()
+        self._tasks: list[asyncio.Task] = []
+        self._last_prune = time.monotonic()
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Останавливаем воркеров; выполняющиеся задачи отменяются."""
+        tasks, self._tasks = self._tasks, []
+        tasks += [job.task for job in self._jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self._pending:
+            job.finish(CANCELLED)
+        self._pending.clear()
+
+    async def submit(self, owner: Hashable, run: Callable[[Job], Awaitable[None]]) -> Job:
+        current = self._jobs.get(owner)
+        if current is not None and current.active:
+            raise JobRejected("У вас уже есть задача генерации.", current)
+        if len(self._pending) >= self.max_queued:
+            raise JobRejected("Очередь генерации переполнена, попробуйте позже.")
+        self._prune()
+        job = Job(owner, run)
+        self._jobs[owner] = job
+        self._pending.append(job)
+        async with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def cancel(self, owner: Hashable) -> Optional[Job]:
+        """
+        Отменяем активную задачу пользователя: из очереди она просто убирается, у выполняющейся
+        отменяется asyncio-задача (вместе с ней — запросы к LLM). None — отменять нечего.
+        """
+        job = self._jobs.get(owner)
+        if job is None or not job.active:
+            return None
+        if job.state == QUEUED:
+            self._pending.remove(job)
+            job.finish(CANCELLED)
+        elif job.task is not None:
+            job.task.cancel()
+        return job
+
+    def get(self, owner: Hashable) -> Optional[Job]:
+        """Активная или последняя завершённая задача пользователя."""
+        return self._jobs.get(owner)
+
+    def _prune(self) -> None:
+        """Забываем задачи, завершённые больше _FINISHED_TTL секунд назад."""
+        now = time.monotonic()
+        if now - self._last_prune < _PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        expired = [
+            owner
+            for owner, job in self._jobs.items()
+            if not job.active and job.finished_at is not None and now - job.finished_at > _FINISHED_TTL
+        ]
+        for owner in expired:
+            del self._jobs[owner]
+
+    def position(self, job: Job) -> int:
+        """Место в очереди, начиная с 1 (0 — задача уже не в очереди)."""
+        for idx, queued in enumerate(self._pending, start=1):
+            if queued is job:
+                return idx
+        return 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.state == RUNNING)
+
+    async def _next(self) -> Job:
+        async with self._wakeup:
+            await self._wakeup.wait_for(lambda: bool(self._pending))
+            return self._pending.popleft()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._next()
+            job.state = RUNNING
+            job.started_at = time.monotonic()
+            # Задача выполняется в отдельной asyncio-задаче: её отмена (/cancel) не останавливает воркер
+            task = job.task = asyncio.create_task(job.run(job))
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                job.finish(CANCELLED)
+                raise
+            if task.cancelled():
+                job.finish(CANCELLED)
+            elif task.exception() is not None:
+                job.error = str(task.exception())
+                job.finish(FAILED)
+            else:
+                job.finish(DONE)
+
+
+job_queue = JobQueue()
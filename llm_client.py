@@ -1,20 +1,58 @@
+import time
+from typing import AsyncIterator, Optional
+
+from circuit_breaker import CircuitBreaker
 from config import (
+    LLM_HEDGE_ENABLED,
     LLM_PROVIDER,
+    LLM_PROVIDER_CHAIN,
+    LLM_TEMPERATURE,
     OLLAMA_ENDPOINT,
     OLLAMA_MODEL,
     OPENROUTER_API_KEY,
+    OPENROUTER_MODEL,
     QWEN_API_KEY,
+    QWEN_MODEL,
+)
+from generation_cache import get_cache, make_cache_key
+from hedging import hedge_delay, hedge_stats, hedged, record_latency
+from local_generator import generate_batch_local, generate_exercises_local
+from metrics import llm_cache_total, llm_failures_total
+from ollama_client import OllamaError, generate_exercises_ollama, stream_exercises_ollama
+from openrouter_client import (
+    OpenRouterError,
+    generate_exercises_openrouter,
+    stream_exercises_openrouter,
 )
-from local_generator import generate_exercises_local
-from ollama_client import OllamaError, generate_exercises_ollama
-from openrouter_client import OpenRouterError, generate_exercises_openrouter
 from qwen_client import QwenAPIError, generate_exercises as generate_exercises_qwen
+from qwen_client import stream_exercises as stream_exercises_qwen
+from tracing import span
+
+
+# Providers whose responses are worth caching (local templates are free)
+CACHEABLE_PROVIDERS = {"openrouter", "qwen", "ollama"}
+KNOWN_PROVIDERS = CACHEABLE_PROVIDERS | {"local"}
+
+PROVIDER_ERRORS = (OpenRouterError, QwenAPIError, OllamaError)
+
+# Cheap prompt used by background health probes of tripped providers
+_PROBE_PROMPT = "Reply with the single word OK."
+
+_breakers: dict[str, CircuitBreaker] = {}
 
 
 class LLMError(Exception):
     """Unified generation error."""
 
 
+class ProviderUnavailable(LLMError):
+    """The provider's circuit breaker is open."""
+
+
+class ProviderMisconfigured(LLMError):
+    """The provider lacks its API key or model; never counted by the circuit breaker."""
+
+
 def _has_real_openrouter_key() -> bool:
     if not OPENROUTER_API_KEY:
         return False
@@ -48,39 +86,283 @@ def _resolve_provider() -> str:
     return "local"
 
 
-async def generate_exercises(prompt: str, count: int, vocab_words: list[str]) -> str:
+def _provider_chain() -> list[str]:
     """
-    Unified generator:
-    - openrouter (Qwen via OpenRouter) when key is present
-    - qwen (DashScope) when key is present
-    - ollama (local)
-    - local templates if no provider is configured
+    Ordered providers to try. LLM_PROVIDER_CHAIN wins; otherwise the single resolved provider,
+    plus local templates for an auto-selected qwen (as before, explicit providers do not fall back).
     """
+    if LLM_PROVIDER_CHAIN:
+        return list(LLM_PROVIDER_CHAIN)
     provider = _resolve_provider()
+    if provider == "qwen" and not LLM_PROVIDER:
+        return [provider, "local"]
+    return [provider]
+
 
+def _provider_model(provider: str) -> tuple[str, Optional[float]]:
+    """Model and temperature of a provider (both are part of the cache key)."""
     if provider == "openrouter":
-        try:
-            return await generate_exercises_openrouter(prompt, OPENROUTER_API_KEY)
-        except OpenRouterError as exc:
-            raise LLMError(str(exc)) from exc
+        return OPENROUTER_MODEL, LLM_TEMPERATURE
+    if provider == "qwen":
+        return QWEN_MODEL, LLM_TEMPERATURE
+    if provider == "ollama":
+        return OLLAMA_MODEL, None
+    return "", None
 
+
+async def _call_provider(provider: str, prompt: str, **options) -> str:
+    if provider == "openrouter":
+        return await generate_exercises_openrouter(prompt, OPENROUTER_API_KEY, **options)
     if provider == "qwen":
-        try:
-            return await generate_exercises_qwen(prompt, QWEN_API_KEY)
-        except QwenAPIError as exc:
-            if LLM_PROVIDER:
-                raise LLMError(str(exc)) from exc
-            return generate_exercises_local(count, vocab_words)
+        return await generate_exercises_qwen(prompt, QWEN_API_KEY, **options)
+    if provider == "ollama":
+        return await generate_exercises_ollama(prompt, OLLAMA_MODEL, OLLAMA_ENDPOINT, **options)
+    raise LLMError(f"Unknown LLM_PROVIDER: {provider}")
+
 
+def _stream_provider(provider: str, prompt: str) -> AsyncIterator[str]:
+    if provider == "openrouter":
+        return stream_exercises_openrouter(prompt, OPENROUTER_API_KEY)
+    if provider == "qwen":
+        return stream_exercises_qwen(prompt, QWEN_API_KEY)
     if provider == "ollama":
-        try:
-            return await generate_exercises_ollama(prompt, OLLAMA_MODEL, OLLAMA_ENDPOINT)
-        except OllamaError as exc:
-            if LLM_PROVIDER:
-                raise LLMError(str(exc)) from exc
-            return generate_exercises_local(count, vocab_words)
+        return stream_exercises_ollama(prompt, OLLAMA_MODEL, OLLAMA_ENDPOINT)
+    raise LLMError(f"Unknown LLM_PROVIDER: {provider}")
+
+
+def _breaker(provider: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        # A single attempt without retries: the probe repeats every probe_interval anyway
+        breaker = CircuitBreaker(provider, probe=lambda: _call_provider(provider, _PROBE_PROMPT, max_retries=1))
+        _breakers[provider] = breaker
+    return breaker
+
+
+def _check_provider(provider: str) -> None:
+    if provider not in KNOWN_PROVIDERS:
+        raise LLMError(f"Unknown LLM_PROVIDER: {provider}")
+
+
+def _check_config(provider: str) -> None:
+    """Missing settings are not an outage: raise before the request so the breaker never sees them."""
+    if provider == "openrouter" and not OPENROUTER_API_KEY:
+        raise ProviderMisconfigured("OPENROUTER_API_KEY is not set in the environment.")
+    if provider == "openrouter" and not OPENROUTER_MODEL:
+        raise ProviderMisconfigured("OPENROUTER_MODEL is not set in the environment.")
+    if provider == "qwen" and not QWEN_API_KEY:
+        raise ProviderMisconfigured("QWEN_API_KEY is not set in the environment.")
+
+
+async def _lookup_cache(provider: str, prompt: str, use_cache: bool) -> tuple[Optional[str], Optional[str]]:
+    """(cache_key, cached text) for a provider; the key is None when caching does not apply."""
+    cache = get_cache() if use_cache and provider in CACHEABLE_PROVIDERS else None
+    if cache is None:
+        return None, None
+    model, temperature = _provider_model(provider)
+    cache_key = make_cache_key(provider, model, temperature, prompt)
+    cached = await cache.aget(cache_key)
+    llm_cache_total.inc(provider=provider, result="miss" if cached is None else "hit")
+    return cache_key, cached
+
+
+async def _remember(cache_key: Optional[str], provider: str, text: str) -> str:
+    cache = get_cache()
+    if cache_key and cache is not None:
+        await cache.aput(cache_key, provider, _provider_model(provider)[0], text)
+    return text
+
 
+def is_remote_provider() -> bool:
+    """True when generation goes to an LLM first (not to local templates)."""
+    return _provider_chain()[0] in CACHEABLE_PROVIDERS
+
+
+def provider_health() -> dict[str, dict]:
+    """Circuit breaker state of every provider used so far."""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
+
+
+def hedge_counters() -> dict:
+    """How often hedged requests fired and how often the secondary provider won."""
+    return hedge_stats.snapshot()
+
+
+async def close_breakers() -> None:
+    """Stop background probes (called on bot shutdown)."""
+    for breaker in _breakers.values():
+        await breaker.stop()
+
+
+def _generate_local(count: int, vocab_words: list[str], units: Optional[list] = None) -> str:
+    """Local templates; for a batch prompt the answer is split per unit like a model's would be."""
+    if units:
+        return generate_batch_local(units)
+    return generate_exercises_local(count, vocab_words)
+
+
+async def _attempt(
+    provider: str,
+    prompt: str,
+    count: int,
+    vocab_words: list[str],
+    use_cache: bool,
+    units: Optional[list] = None,
+) -> str:
+    """
+    One provider of the chain: cache lookup, circuit breaker, completion.
+    Raises ProviderMisconfigured for missing settings, ProviderUnavailable when the breaker is open
+    and provider errors as they are.
+    """
     if provider == "local":
-        return generate_exercises_local(count, vocab_words)
+        return _generate_local(count, vocab_words, units)
 
-    raise LLMError(f"Unknown LLM_PROVIDER: {provider}")
+    with span("llm", provider=provider) as current:
+        cache_key, cached = await _lookup_cache(provider, prompt, use_cache)
+        if current is not None:
+            current.set(cached=cached is not None)
+        if cached is not None:
+            return cached
+
+        _check_config(provider)
+        breaker = _breaker(provider)
+        if not breaker.allow():
+            raise ProviderUnavailable(f"{provider} is temporarily unavailable")
+        started = time.monotonic()
+        try:
+            text = await _call_provider(provider, prompt)
+        except PROVIDER_ERRORS:
+            breaker.record_failure()
+            llm_failures_total.inc(provider=provider)
+            raise
+        latency = time.monotonic() - started
+        breaker.record_success(latency)
+        record_latency(provider, latency)
+        return await _remember(cache_key, provider, text)
+
+
+def _hedge_partner(chain: list[str], idx: int, tried: set[int]) -> Optional[int]:
+    """
+    Index of the provider to hedge chain[idx] with: the first one further down the chain that can
+    take the request now (local templates, already tried providers, open breakers and missing
+    settings are skipped). None when hedging does not apply.
+    """
+    if not LLM_HEDGE_ENABLED or chain[idx] == "local":
+        return None
+    for partner_idx in range(idx + 1, len(chain)):
+        partner = chain[partner_idx]
+        _check_provider(partner)
+        if partner_idx in tried or partner == "local" or partner == chain[idx]:
+            continue
+        try:
+            _check_config(partner)
+        except ProviderMisconfigured:
+            continue
+        breaker = _breakers.get(partner)
+        if breaker is None or breaker.allow():
+            return partner_idx
+    return None
+
+
+async def generate_exercises(
+    prompt: str,
+    count: int,
+    vocab_words: list[str],
+    use_cache: bool = True,
+    units: Optional[list[tuple[str, int, list[str]]]] = None,
+) -> str:
+    """
+    Unified generator over the provider chain (see _provider_chain), e.g.
+    openrouter -> ollama -> local. A failing provider passes the prompt to the next one;
+    after repeated failures or slow answers its circuit breaker opens and the provider is
+    skipped instantly until a background probe succeeds.
+
+    With LLM_HEDGE_ENABLED, a provider that has not answered within its recent latency
+    percentile is raced against the next available provider of the chain; the first answer wins
+    and the other request is cancelled (see hedging).
+
+    Responses of remote providers are cached on disk (see generation_cache);
+    pass use_cache=False to force a fresh completion.
+    Local template fallbacks are never cached. For a batch prompt pass its units
+    ([(unit, count, words), ...]) so that a local fallback answers per unit as well.
+    """
+    chain = _provider_chain()
+    last_error: Optional[Exception] = None
+    # Hedge partners that have already been tried
+    tried: set[int] = set()
+    for idx, provider in enumerate(chain):
+        if idx in tried:
+            continue
+        _check_provider(provider)
+        partner_idx = _hedge_partner(chain, idx, tried)
+        try:
+            if partner_idx is None:
+                return await _attempt(provider, prompt, count, vocab_words, use_cache, units)
+            partner = chain[partner_idx]
+            return await hedged(
+                lambda: _attempt(provider, prompt, count, vocab_words, use_cache, units),
+                lambda: _attempt(partner, prompt, count, vocab_words, use_cache, units),
+                hedge_delay(provider),
+            )
+        except (ProviderUnavailable, ProviderMisconfigured, *PROVIDER_ERRORS) as exc:
+            last_error = exc
+        if partner_idx is not None:
+            tried.add(partner_idx)
+
+    raise LLMError(str(last_error)) from last_error
+
+
+async def stream_exercises(
+    prompt: str,
+    count: int,
+    vocab_words: list[str],
+    use_cache: bool = True,
+    units: Optional[list[tuple[str, int, list[str]]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of generate_exercises: yields text chunks as the provider produces them.
+    Cache hits and local templates arrive as a single chunk. The next provider of the chain
+    takes over only while nothing has been yielded yet; latency is measured to the first chunk.
+    """
+    last_error: Optional[Exception] = None
+    for provider in _provider_chain():
+        _check_provider(provider)
+        if provider == "local":
+            yield _generate_local(count, vocab_words, units)
+            return
+
+        cache_key, cached = await _lookup_cache(provider, prompt, use_cache)
+        if cached is not None:
+            yield cached
+            return
+
+        try:
+            _check_config(provider)
+        except ProviderMisconfigured as exc:
+            last_error = exc
+            continue
+        breaker = _breaker(provider)
+        if not breaker.allow():
+            last_error = ProviderUnavailable(f"{provider} is temporarily unavailable")
+            continue
+        started = time.monotonic()
+        chunks: list[str] = []
+        try:
+            async for chunk in _stream_provider(provider, prompt):
+                if not chunks:
+                    breaker.record_success(time.monotonic() - started)
+                chunks.append(chunk)
+                yield chunk
+        except PROVIDER_ERRORS as exc:
+            breaker.record_failure()
+            llm_failures_total.inc(provider=provider)
+            if chunks:
+                raise LLMError(str(exc)) from exc
+            last_error = exc
+            continue
+        if not chunks:
+            breaker.record_success(time.monotonic() - started)
+        await _remember(cache_key, provider, "".join(chunks))
+        return
+
+    raise LLMError(str(last_error)) from last_error
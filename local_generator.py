@@ -124,6 +124,15 @@ def generate_exercises_local(count: int, vocab_words: list[str]) -> str:
     return "\n".join(lines)
 
 
+def generate_batch_local(units: list[tuple[str, int, list[str]]]) -> str:
+    """
+    Локальная генерация для пакетного промпта: по каждому юниту [(unit, count, words), ...]
+    своя метка [UNIT N] и упражнения только на его лексику — в формате ответа модели на пакет.
+    """
+    blocks = [f"[{unit}]\n{generate_exercises_local(count, words)}" for unit, count, words in units]
+    return "\n".join(blocks)
+
+
 def _categorize_words(words: list[str]) -> tuple[list[str], list[str], list[str], list[str]]:
     noun_words: list[str] = []
     adj_words: list[str] = []
@@ -0,0 +1,357 @@
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Iterator, Union
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+from tracing import span
+
+# Границы корзин гистограмм (секунды): от быстрых обработчиков до долгих генераций
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = tuple[str, ...]
+
+_SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?( .*)$")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """Набор метрик процесса, отдаётся в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: list["_Metric"] = []
+
+    def register(self, metric: "_Metric") -> None:
+        self._metrics.append(metric)
+
+    def metrics(self) -> list["_Metric"]:
+        return list(self._metrics)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _format_labels(labels: list[tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), registry: Registry = registry):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # Метрики обновляются и из потоков пула CPU-задач
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: LabelKey) -> list[tuple[str, str]]:
+        return list(zip(self.labelnames, key))
+
+    def samples(self) -> list[tuple[str, list[tuple[str, str]], float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        return [("", self._labels(key), value) for key, value in sorted(self.values().items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """Значение увеличено на 1, пока выполняется блок (запросы «в полёте»)."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [счётчики по корзинам (не накопительные), сумма, количество]
+        self._values: dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = 0
+        while value > self.buckets[idx]:
+            idx += 1
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> dict[LabelKey, dict]:
+        """count, sum и оценки p50/p95 (линейная интерполяция внутри корзины, как histogram_quantile)."""
+        with self._lock:
+            values = {key: (list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()}
+        return {
+            key: {
+                "count": count,
+                "sum": total,
+                "p50": self._quantile(counts, count, 0.5),
+                "p95": self._quantile(counts, count, 0.95),
+            }
+            for key, (counts, total, count) in values.items()
+        }
+
+    def _quantile(self, counts: list[int], count: int, q: float) -> float:
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for upper, in_bucket in zip(self.buckets, counts):
+            if in_bucket and seen + in_bucket >= rank:
+                if upper == float("inf"):
+                    # Выше последней границы оценить нельзя
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / in_bucket
+            seen += in_bucket
+            lower = upper
+        return lower
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items())
+        result = []
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for upper, in_bucket in zip(self.buckets, counts):
+                cumulative += in_bucket
+                result.append(("_bucket", labels + [("le", _format_value(upper))], cumulative))
+            result.append(("_sum", labels, total))
+            result.append(("_count", labels, count))
+        return result
+
+
+class CallbackMetric(_Metric):
+    """Значение читается в момент выгрузки: fn возвращает число или {значения меток: число}."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Union[float, dict]], kind: str = "gauge", **kwargs):
+        super().__init__(name, help, **kwargs)
+        self.kind = kind
+        self._fn = fn
+
+    def samples(self):
+        value = self._fn()
+        if not isinstance(value, dict):
+            return [("", [], value)]
+        return [
+            ("", self._labels(key if isinstance(key, tuple) else (key,)), item)
+            for key, item in sorted(value.items())
+        ]
+
+
+# Обработчики и этапы /generate и загрузки файлов
+handler_seconds = Histogram("bot_handler_seconds", "Handler execution time", ("handler",))
+handlers_in_flight = Gauge("bot_handlers_in_flight", "Handlers being executed", ("handler",))
+stage_seconds = Histogram(
+    "bot_stage_seconds", "Time per stage: download, parse, analyze, generate, xlsx, upload", ("stage",)
+)
+generations_total = Counter("bot_generations_total", "Finished generation jobs by result", ("result",))
+xlsx_build_seconds = Histogram("bot_xlsx_build_seconds", "XLSX rendering time", ("kind",))
+
+# Провайдеры LLM
+llm_response_seconds = Histogram(
+    "bot_llm_response_seconds", "Time until LLM response headers per HTTP attempt", ("provider",)
+)
+llm_in_flight = Gauge("bot_llm_in_flight", "LLM HTTP requests in flight", ("provider",))
+llm_retries_total = Counter(
+    "bot_llm_retries_total", "LLM request retries by reason (rate_limited = HTTP 429)", ("provider", "reason")
+)
+llm_failures_total = Counter("bot_llm_failures_total", "Failed LLM completions by provider", ("provider",))
+llm_cache_total = Counter("bot_llm_cache_total", "LLM response cache lookups", ("provider", "result"))
+
+
+@asynccontextmanager
+async def llm_request(provider: str, request: AsyncContextManager[Any], attempt: int = 0) -> AsyncIterator[Any]:
+    """
+    Одна попытка HTTP-запроса к провайдеру (request — session.post(...)): время до заголовков
+    ответа (для потоковых ответов — примерно до первого фрагмента) и число запросов «в полёте».
+    Сетевые ошибки до ответа тоже попадают в гистограмму. При включённой трассировке попытка
+    записывается спаном llm.attempt.
+    """
+    attempt_span = span("llm.attempt", leaf=True, provider=provider, attempt=attempt)
+    with llm_in_flight.track(provider=provider), attempt_span as current:
+        started = time.perf_counter()
+        answered = False
+        try:
+            async with request as response:
+                llm_response_seconds.observe(time.perf_counter() - started, provider=provider)
+                answered = True
+                if current is not None:
+                    current.set(status=response.status)
+                yield response
+        finally:
+            if not answered:
+                llm_response_seconds.observe(time.perf_counter() - started, provider=provider)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и число выполняющихся обработчиков aiogram (метка — имя функции обработчика)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with handlers_in_flight.track(handler=name), handler_seconds.time(handler=name):
+            return await handler(event, data)
+
+
+def add_label(text: str, name: str, value: str) -> str:
+    """Добавляем метку ко всем сэмплам выгрузки (чтобы объединить метрики нескольких процессов)."""
+    label = f'{name}="{_escape(value)}"'
+    lines = []
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line) if line and not line.startswith("#") else None
+        if match is None:
+            lines.append(line)
+            continue
+        metric, labels, rest = match.groups()
+        lines.append(f"{metric}{{{label + ',' + labels if labels else label}}}{rest}")
+    return "\n".join(lines) + "\n"
+
+
+def merge_texts(texts: list[str]) -> str:
+    """Склеиваем выгрузки: сэмплы одной метрики идут подряд, HELP/TYPE — по одному разу."""
+    order: list[str] = []
+    headers: dict[str, list[str]] = {}
+    samples: dict[str, list[str]] = {}
+    current = ""
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                current = line.split(" ", 3)[2]
+                if current not in headers:
+                    order.append(current)
+                    headers[current] = []
+                    samples[current] = []
+                if len(headers[current]) < 2:
+                    headers[current].append(line)
+            elif line and current:
+                samples[current].append(line)
+    lines: list[str] = []
+    for metric in order:
+        lines.extend(headers[metric])
+        lines.extend(samples[metric])
+    return "\n".join(lines) + "\n"
+
+
+def format_report() -> str:
+    """Краткая сводка для /stats: перцентили по этапам и ненулевые счётчики."""
+    lines: list[str] = []
+    for metric in registry.metrics():
+        if isinstance(metric, Histogram):
+            snapshot = metric.snapshot()
+            if not snapshot:
+                continue
+            lines.append(f"{metric.name}:")
+            for key, item in sorted(snapshot.items()):
+                label = ",".join(key) or "-"
+                avg = item["sum"] / item["count"] if item["count"] else 0.0
+                lines.append(
+                    f"  {label}: n={item['count']} avg={avg:.3f}s p50≈{item['p50']:.3f}s p95≈{item['p95']:.3f}s"
+                )
+        elif isinstance(metric, (Counter, CallbackMetric)):
+            samples = [(labels, value) for _, labels, value in metric.samples() if value]
+            if not samples:
+                continue
+            lines.append(f"{metric.name}:")
+            for labels, value in samples:
+                label = ",".join(label_value for _, label_value in labels) or "-"
+                lines.append(f"  {label}: {_format_value(value)}")
+    return "\n".join(lines) or "Метрик пока нет."
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(
+    host: str, port: int, handler: Callable[[web.Request], Awaitable[web.Response]] = handle_metrics
+) -> web.AppRunner:
+    """Отдельный HTTP-сервер с GET /metrics (для режима polling, где своего веб-сервера нет)."""
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,8 +1,13 @@
 import asyncio
-from typing import Optional
+import json
+from typing import AsyncIterator, Optional
 
 import aiohttp
 
+from http_session import shared_session
+from metrics import llm_request, llm_retries_total
+from rate_limiter import get_limiter
+
 
 class OllamaError(Exception):
     """Ошибки работы с Ollama."""
@@ -18,11 +23,19 @@ async def generate_exercises_ollama(
         "stream": False,
     }
 
-    async with aiohttp.ClientSession() as session:
+    limiter = get_limiter("ollama")
+
+    async with shared_session() as session:
         for attempt in range(max_retries):
+            await limiter.acquire()
             try:
-                async with session.post(endpoint, json=payload, timeout=60) as resp:
+                async with llm_request(
+                    "ollama", session.post(endpoint, json=payload, timeout=60), attempt
+                ) as resp:
                     if resp.status >= 500:
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="ollama", reason="server_error")
                         await asyncio.sleep(1 + attempt)
                         continue
                     if resp.status >= 400:
@@ -36,6 +49,67 @@ async def generate_exercises_ollama(
             except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
                 if attempt >= max_retries - 1:
                     raise OllamaError(f"Сетевая ошибка Ollama: {exc}") from exc
+                llm_retries_total.inc(provider="ollama", reason="network")
+                await asyncio.sleep(1 + attempt)
+
+    raise OllamaError("Не удалось получить ответ от Ollama.")
+
+
+async def stream_exercises_ollama(
+    prompt: str, model: str, endpoint: str, max_retries: int = 2
+) -> AsyncIterator[str]:
+    """
+    Вызывает Ollama с stream=true (ответ — JSON-объект на строку) и отдаёт фрагменты текста.
+    Повторные попытки — только до первого фрагмента.
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+    }
+
+    limiter = get_limiter("ollama")
+
+    async with shared_session() as session:
+        for attempt in range(max_retries):
+            await limiter.acquire()
+            started = False
+            try:
+                async with llm_request(
+                    "ollama", session.post(endpoint, json=payload, timeout=60), attempt
+                ) as resp:
+                    if resp.status >= 500:
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="ollama", reason="server_error")
+                        await asyncio.sleep(1 + attempt)
+                        continue
+                    if resp.status >= 400:
+                        text = await resp.text()
+                        raise OllamaError(f"Ошибка Ollama {resp.status}: {text}")
+                    async for raw_line in resp.content:
+                        line = raw_line.strip()
+                        if not line:
+                            continue
+                        try:
+                            data = json.loads(line)
+                        except ValueError:
+                            continue
+                        if isinstance(data, dict) and data.get("error"):
+                            raise OllamaError(f"Ошибка Ollama: {data['error']}")
+                        text = _extract_text(data)
+                        if text:
+                            started = True
+                            yield text
+                        if isinstance(data, dict) and data.get("done"):
+                            break
+                    if not started:
+                        raise OllamaError("Пустой ответ от Ollama.")
+                    return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if started or attempt >= max_retries - 1:
+                    raise OllamaError(f"Сетевая ошибка Ollama: {exc}") from exc
+                llm_retries_total.inc(provider="ollama", reason="network")
                 await asyncio.sleep(1 + attempt)
 
     raise OllamaError("Не удалось получить ответ от Ollama.")
@@ -1,27 +1,33 @@
 import asyncio
-from typing import Optional
+import json
+from typing import AsyncIterator, Optional
 
 import aiohttp
 
 from config import (
+    LLM_TEMPERATURE,
     OPENROUTER_ENDPOINT,
     OPENROUTER_MODEL,
     OPENROUTER_REFERER,
     OPENROUTER_TITLE,
 )
+from http_session import iter_sse_data, shared_session
+from metrics import llm_request, llm_retries_total
+from rate_limiter import backoff_delay, estimate_tokens, get_limiter, retry_after_delay
 
 
 class OpenRouterError(Exception):
     """Errors when calling OpenRouter API."""
 
 
-async def generate_exercises_openrouter(prompt: str, api_key: str, max_retries: int = 3) -> str:
-    """Call OpenRouter API and return generated text."""
+def _check_config(api_key: str) -> None:
     if not api_key:
         raise OpenRouterError("OPENROUTER_API_KEY is not set in the environment.")
     if not OPENROUTER_MODEL:
         raise OpenRouterError("OPENROUTER_MODEL is not set in the environment.")
 
+
+def _build_headers(api_key: str) -> dict:
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -30,24 +36,49 @@ async def generate_exercises_openrouter(prompt: str, api_key: str, max_retries:
         headers["HTTP-Referer"] = OPENROUTER_REFERER
     if OPENROUTER_TITLE:
         headers["X-Title"] = OPENROUTER_TITLE
+    return headers
 
+
+def _build_payload(prompt: str, stream: bool = False) -> dict:
     payload = {
         "model": OPENROUTER_MODEL,
         "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7,
+        "temperature": LLM_TEMPERATURE,
     }
+    if stream:
+        payload["stream"] = True
+    return payload
+
 
-    async with aiohttp.ClientSession() as session:
+async def generate_exercises_openrouter(prompt: str, api_key: str, max_retries: int = 3) -> str:
+    """Call OpenRouter API and return generated text."""
+    _check_config(api_key)
+    headers = _build_headers(api_key)
+    payload = _build_payload(prompt)
+    limiter = get_limiter("openrouter")
+    prompt_tokens = estimate_tokens(prompt)
+
+    async with shared_session() as session:
         for attempt in range(max_retries):
+            await limiter.acquire(prompt_tokens)
             try:
-                async with session.post(
-                    OPENROUTER_ENDPOINT, headers=headers, json=payload, timeout=60
+                async with llm_request(
+                    "openrouter",
+                    session.post(OPENROUTER_ENDPOINT, headers=headers, json=payload, timeout=60),
+                    attempt,
                 ) as resp:
                     if resp.status == 429:
-                        await asyncio.sleep(2**attempt)
+                        # Пауза общая для всех запросов к OpenRouter (см. rate_limiter)
+                        limiter.penalize(retry_after_delay(resp.headers, attempt))
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="openrouter", reason="rate_limited")
                         continue
                     if resp.status >= 500:
-                        await asyncio.sleep(2**attempt)
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="openrouter", reason="server_error")
+                        await asyncio.sleep(backoff_delay(attempt))
                         continue
                     if resp.status >= 400:
                         text = await resp.text()
@@ -64,11 +95,80 @@ async def generate_exercises_openrouter(prompt: str, api_key: str, max_retries:
                     content = _extract_text(data)
                     if not content:
                         raise OpenRouterError("Empty response from OpenRouter.")
+                    limiter.charge_text(content)
                     return content
             except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
                 if attempt >= max_retries - 1:
                     raise OpenRouterError(f"Network error calling OpenRouter: {exc}") from exc
-                await asyncio.sleep(2**attempt)
+                llm_retries_total.inc(provider="openrouter", reason="network")
+                await asyncio.sleep(backoff_delay(attempt))
+
+    raise OpenRouterError("Failed to get response from OpenRouter after retries.")
+
+
+async def stream_exercises_openrouter(
+    prompt: str, api_key: str, max_retries: int = 3
+) -> AsyncIterator[str]:
+    """
+    Call OpenRouter with stream=true and yield text chunks as they arrive.
+    Retries happen only before the first chunk; a failure mid-stream raises OpenRouterError.
+    """
+    _check_config(api_key)
+    headers = _build_headers(api_key)
+    payload = _build_payload(prompt, stream=True)
+    limiter = get_limiter("openrouter")
+    prompt_tokens = estimate_tokens(prompt)
+
+    async with shared_session() as session:
+        for attempt in range(max_retries):
+            await limiter.acquire(prompt_tokens)
+            started = False
+            try:
+                async with llm_request(
+                    "openrouter",
+                    session.post(OPENROUTER_ENDPOINT, headers=headers, json=payload, timeout=60),
+                    attempt,
+                ) as resp:
+                    if resp.status == 429:
+                        limiter.penalize(retry_after_delay(resp.headers, attempt))
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="openrouter", reason="rate_limited")
+                        continue
+                    if resp.status >= 500:
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="openrouter", reason="server_error")
+                        await asyncio.sleep(backoff_delay(attempt))
+                        continue
+                    if resp.status >= 400:
+                        text = await resp.text()
+                        raise OpenRouterError(f"OpenRouter API error {resp.status}: {text}")
+
+                    async for data in iter_sse_data(resp):
+                        if data == "[DONE]":
+                            break
+                        try:
+                            event = json.loads(data)
+                        except ValueError:
+                            continue
+                        error = event.get("error") if isinstance(event, dict) else None
+                        if error:
+                            message = error.get("message") if isinstance(error, dict) else None
+                            raise OpenRouterError(f"OpenRouter error: {message or error}")
+                        delta = _extract_delta(event)
+                        if delta:
+                            started = True
+                            limiter.charge_text(delta)
+                            yield delta
+                    if not started:
+                        raise OpenRouterError("Empty response from OpenRouter.")
+                    return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if started or attempt >= max_retries - 1:
+                    raise OpenRouterError(f"Network error calling OpenRouter: {exc}") from exc
+                llm_retries_total.inc(provider="openrouter", reason="network")
+                await asyncio.sleep(backoff_delay(attempt))
 
     raise OpenRouterError("Failed to get response from OpenRouter after retries.")
 
@@ -89,3 +189,16 @@ def _extract_text(data: dict) -> Optional[str]:
         if "text" in choice0:
             return choice0.get("text")
     return None
+
+
+def _extract_delta(event: dict) -> Optional[str]:
+    choices = event.get("choices") if isinstance(event, dict) else None
+    if not isinstance(choices, list) or not choices:
+        return None
+    choice0 = choices[0]
+    if not isinstance(choice0, dict):
+        return None
+    delta = choice0.get("delta")
+    if isinstance(delta, dict):
+        return delta.get("content")
+    return choice0.get("text")
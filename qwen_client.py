@@ -1,22 +1,20 @@
 import asyncio
-from typing import Optional
+import json
+from typing import AsyncIterator, Optional
 
 import aiohttp
 
-from config import QWEN_ENDPOINT, QWEN_MODEL
+from config import LLM_TEMPERATURE, QWEN_ENDPOINT, QWEN_MODEL
+from http_session import iter_sse_data, shared_session
+from metrics import llm_request, llm_retries_total
+from rate_limiter import backoff_delay, estimate_tokens, get_limiter, retry_after_delay
 
 
 class QwenAPIError(Exception):
     """Ошибки работы с Qwen API."""
 
 
-async def generate_exercises(prompt: str, api_key: str, max_retries: int = 3) -> str:
-    """
-    Вызывает DashScope (Qwen) и возвращает сгенерированный текст.
-    """
-    if not api_key:
-        raise QwenAPIError("Не задан QWEN_API_KEY в переменных окружения.")
-
+def _build_request(prompt: str, api_key: str, stream: bool = False) -> tuple[dict, dict]:
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -26,20 +24,48 @@ async def generate_exercises(prompt: str, api_key: str, max_retries: int = 3) ->
         "input": {"prompt": prompt},
         "parameters": {
             "result_format": "message",
-            "temperature": 0.7,
+            "temperature": LLM_TEMPERATURE,
         },
     }
+    if stream:
+        # SSE-режим DashScope: каждое событие содержит только новый фрагмент текста
+        headers["X-DashScope-SSE"] = "enable"
+        payload["parameters"]["incremental_output"] = True
+    return headers, payload
+
+
+async def generate_exercises(prompt: str, api_key: str, max_retries: int = 3) -> str:
+    """
+    Вызывает DashScope (Qwen) и возвращает сгенерированный текст.
+    """
+    if not api_key:
+        raise QwenAPIError("Не задан QWEN_API_KEY в переменных окружения.")
 
-    async with aiohttp.ClientSession() as session:
+    headers, payload = _build_request(prompt, api_key)
+    limiter = get_limiter("qwen")
+    prompt_tokens = estimate_tokens(prompt)
+
+    async with shared_session() as session:
         for attempt in range(max_retries):
+            await limiter.acquire(prompt_tokens)
             try:
-                async with session.post(QWEN_ENDPOINT, headers=headers, json=payload, timeout=60) as resp:
+                async with llm_request(
+                    "qwen",
+                    session.post(QWEN_ENDPOINT, headers=headers, json=payload, timeout=60),
+                    attempt,
+                ) as resp:
                     if resp.status == 429:
-                        # Rate limit — ждём и повторяем
-                        await asyncio.sleep(2 ** attempt)
+                        # Rate limit — пауза общая для всех запросов к Qwen (см. rate_limiter)
+                        limiter.penalize(retry_after_delay(resp.headers, attempt))
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="qwen", reason="rate_limited")
                         continue
                     if resp.status >= 500:
-                        await asyncio.sleep(2 ** attempt)
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="qwen", reason="server_error")
+                        await asyncio.sleep(backoff_delay(attempt))
                         continue
                     if resp.status >= 400:
                         text = await resp.text()
@@ -49,11 +75,75 @@ async def generate_exercises(prompt: str, api_key: str, max_retries: int = 3) ->
                     content = _extract_text(data)
                     if not content:
                         raise QwenAPIError("Пустой ответ от Qwen API.")
+                    limiter.charge_text(content)
                     return content
             except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
                 if attempt >= max_retries - 1:
                     raise QwenAPIError(f"Сетевая ошибка при вызове Qwen: {exc}") from exc
-                await asyncio.sleep(2 ** attempt)
+                llm_retries_total.inc(provider="qwen", reason="network")
+                await asyncio.sleep(backoff_delay(attempt))
+
+    raise QwenAPIError("Не удалось получить ответ от Qwen после повторных попыток.")
+
+
+async def stream_exercises(prompt: str, api_key: str, max_retries: int = 3) -> AsyncIterator[str]:
+    """
+    Вызывает DashScope (Qwen) в потоковом режиме и отдаёт фрагменты текста по мере генерации.
+    Повторные попытки — только до первого фрагмента.
+    """
+    if not api_key:
+        raise QwenAPIError("Не задан QWEN_API_KEY в переменных окружения.")
+
+    headers, payload = _build_request(prompt, api_key, stream=True)
+    limiter = get_limiter("qwen")
+    prompt_tokens = estimate_tokens(prompt)
+
+    async with shared_session() as session:
+        for attempt in range(max_retries):
+            await limiter.acquire(prompt_tokens)
+            started = False
+            try:
+                async with llm_request(
+                    "qwen",
+                    session.post(QWEN_ENDPOINT, headers=headers, json=payload, timeout=60),
+                    attempt,
+                ) as resp:
+                    if resp.status == 429:
+                        limiter.penalize(retry_after_delay(resp.headers, attempt))
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="qwen", reason="rate_limited")
+                        continue
+                    if resp.status >= 500:
+                        if attempt + 1 >= max_retries:
+                            break
+                        llm_retries_total.inc(provider="qwen", reason="server_error")
+                        await asyncio.sleep(backoff_delay(attempt))
+                        continue
+                    if resp.status >= 400:
+                        text = await resp.text()
+                        raise QwenAPIError(f"Ошибка API {resp.status}: {text}")
+
+                    async for data in iter_sse_data(resp):
+                        try:
+                            event = json.loads(data)
+                        except ValueError:
+                            continue
+                        if isinstance(event, dict) and event.get("code"):
+                            raise QwenAPIError(f"Ошибка API: {event.get('message') or event.get('code')}")
+                        content = _extract_text(event)
+                        if content:
+                            started = True
+                            limiter.charge_text(content)
+                            yield content
+                    if not started:
+                        raise QwenAPIError("Пустой ответ от Qwen API.")
+                    return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if started or attempt >= max_retries - 1:
+                    raise QwenAPIError(f"Сетевая ошибка при вызове Qwen: {exc}") from exc
+                llm_retries_total.inc(provider="qwen", reason="network")
+                await asyncio.sleep(backoff_delay(attempt))
 
     raise QwenAPIError("Не удалось получить ответ от Qwen после повторных попыток.")
 
@@ -0,0 +1,133 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping
+
+from config import (
+    OLLAMA_RPS,
+    OPENROUTER_RPS,
+    OPENROUTER_TPM,
+    QWEN_RPS,
+    QWEN_TPM,
+)
+
+# Грубая оценка: ~3 символа на токен для смеси кириллицы и латиницы
+_CHARS_PER_TOKEN = 3
+# Доля случайной добавки к паузам, чтобы клиенты не просыпались одновременно
+_JITTER = 0.25
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def jittered(delay: float) -> float:
+    return delay * (1 + random.uniform(0, _JITTER))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная пауза перед повтором (5xx, сетевые ошибки) со случайной добавкой."""
+    return jittered(2**attempt)
+
+
+def retry_after_delay(headers: Mapping[str, str], attempt: int) -> float:
+    """Пауза по заголовку Retry-After (секунды или HTTP-дата), иначе экспоненциальная."""
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return float(2**attempt)
+
+
+class _Bucket:
+    """Token bucket: rate единиц в секунду, не больше capacity в запасе. rate=0 — без ограничения."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        # Запрос больше ёмкости не должен ждать вечно: достаточно полного ведра
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        """Списываем amount (уровень может уйти в минус — следующие запросы подождут)."""
+        if self.rate:
+            self.level -= amount
+
+
+class RateLimiter:
+    """
+    Общий для всех запросов лимит одного провайдера: запросы в секунду и токены в минуту.
+    Ожидающие обслуживаются по очереди (FIFO), поэтому при всплеске запросов поток к провайдеру
+    держится на уровне квоты, а не скачет. Ответ 429 с Retry-After приостанавливает всех.
+    """
+
+    def __init__(self, requests_per_second: float = 0, tokens_per_minute: float = 0):
+        # Без запаса на всплеск: запросы идут равномерно, по одному каждые 1/rps секунд
+        self._requests = _Bucket(requests_per_second, 1.0)
+        self._tokens = _Bucket(tokens_per_minute / 60, tokens_per_minute)
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Ждём своей очереди на запрос примерно в tokens токенов."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self._blocked_until - now,
+                    self._requests.wait_time(1, now),
+                    self._tokens.wait_time(tokens, now),
+                )
+                if wait <= 0:
+                    self._requests.take(1)
+                    self._tokens.take(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def charge_text(self, text: str) -> None:
+        """Дописываем токены сгенерированного текста: они становятся известны только после ответа."""
+        self._tokens.take(len(text) / _CHARS_PER_TOKEN)
+
+    def penalize(self, delay: float) -> None:
+        """Провайдер ответил 429: никто не отправляет запросы ближайшие delay секунд (+ джиттер)."""
+        until = time.monotonic() + jittered(delay)
+        self._blocked_until = max(self._blocked_until, until)
+        self._requests.level = min(self._requests.level, 0)
+
+
+_LIMITS = {
+    "openrouter": (OPENROUTER_RPS, OPENROUTER_TPM),
+    "qwen": (QWEN_RPS, QWEN_TPM),
+    "ollama": (OLLAMA_RPS, 0),
+}
+
+_limiters: dict[str, RateLimiter] = {}
+
+
+def get_limiter(provider: str) -> RateLimiter:
+    """Лимитер провайдера (один на процесс)."""
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        rps, tpm = _LIMITS.get(provider, (0, 0))
+        limiter = _limiters[provider] = RateLimiter(rps, tpm)
+    return limiter
+
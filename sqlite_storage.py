@@ -0,0 +1,211 @@
+import asyncio
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Any, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import FSM_CACHE_SESSIONS, FSM_DB_PATH, FSM_TTL
+
+# Как часто (в секундах) удалять просроченные сессии
+_PURGE_INTERVAL = 600
+
+
+def _key_to_str(key: StorageKey) -> str:
+    return ":".join(
+        str(part)
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            # Поля нет в aiogram старее 3.5
+            getattr(key, "business_connection_id", None),
+            key.destiny,
+        )
+    )
+
+
+def _pack(value: Any) -> bytes:
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _unpack(blob: bytes) -> Any:
+    return pickle.loads(zlib.decompress(blob))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в SQLite.
+    Каждое поле данных хранится отдельно в сжатом виде (pickle + zlib), поэтому
+    update_data(stats=...) не переписывает большой csv_rows. Распакованные данные держим
+    только для последних cache_sessions сессий, остальные читаются с диска при обращении.
+    Сессии без активности дольше ttl секунд удаляются.
+    """
+
+    def __init__(
+        self, path: str = FSM_DB_PATH, ttl: int = FSM_TTL, cache_sessions: int = FSM_CACHE_SESSIONS
+    ):
+        self.ttl = ttl
+        self.cache_sessions = cache_sessions
+        self._cache: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        # Чтение, слияние и запись данных одной сессии не должны перемежаться
+        # (например, CSV и TXT, присланные одновременно)
+        self._key_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_sessions ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_data ("
+            " key TEXT NOT NULL,"
+            " field TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " PRIMARY KEY (key, field))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS fsm_sessions_updated_at ON fsm_sessions (updated_at)"
+        )
+        self._conn.commit()
+
+    # --- синхронная часть (выполняется в отдельном потоке) ---
+
+    def _touch(self, skey: str, now: float) -> None:
+        self._conn.execute(
+            "INSERT INTO fsm_sessions (key, state, updated_at) VALUES (?, NULL, ?)"
+            " ON CONFLICT(key) DO UPDATE SET updated_at = excluded.updated_at",
+            (skey, now),
+        )
+
+    def _is_expired(self, skey: str, now: float) -> bool:
+        row = self._conn.execute(
+            "SELECT updated_at FROM fsm_sessions WHERE key = ?", (skey,)
+        ).fetchone()
+        return row is None or bool(self.ttl and now - row[0] > self.ttl)
+
+    def _purge(self, now: float) -> None:
+        if not self.ttl or now - self._last_purge < _PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        expired = self._conn.execute(
+            "SELECT key FROM fsm_sessions WHERE updated_at < ?", (now - self.ttl,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM fsm_data WHERE key = ?", expired)
+        self._conn.executemany("DELETE FROM fsm_sessions WHERE key = ?", expired)
+        for (skey,) in expired:
+            self._cache.pop(skey, None)
+
+    def _remember(self, skey: str, data: dict) -> None:
+        self._cache[skey] = data
+        self._cache.move_to_end(skey)
+        while len(self._cache) > self.cache_sessions:
+            self._cache.popitem(last=False)
+
+    def _set_state_sync(self, skey: str, state: Optional[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO fsm_sessions (key, state, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (skey, state, now),
+            )
+            self._purge(now)
+            self._conn.commit()
+
+    def _get_state_sync(self, skey: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, updated_at FROM fsm_sessions WHERE key = ?", (skey,)
+            ).fetchone()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            return None
+        return row[0]
+
+    def _load_sync(self, skey: str) -> dict:
+        now = time.time()
+        with self._lock:
+            # TTL проверяем и для закэшированной сессии — как в _get_state_sync
+            if self._is_expired(skey, now):
+                # Данные просроченной сессии не должны «воскреснуть» при следующей записи
+                self._cache.pop(skey, None)
+                self._conn.execute("DELETE FROM fsm_data WHERE key = ?", (skey,))
+                self._conn.commit()
+                return {}
+            cached = self._cache.get(skey)
+            if cached is not None:
+                self._cache.move_to_end(skey)
+                return cached
+            rows = self._conn.execute(
+                "SELECT field, value FROM fsm_data WHERE key = ?", (skey,)
+            ).fetchall()
+            data = {field: _unpack(value) for field, value in rows}
+            self._remember(skey, data)
+            return data
+
+    def _write_sync(self, skey: str, data: dict, fields: Optional[list[str]]) -> None:
+        """fields=None — полная замена данных, иначе перезаписываем только указанные поля."""
+        now = time.time()
+        packed = [
+            (skey, field, _pack(data[field]))
+            for field in (data if fields is None else fields)
+        ]
+        with self._lock:
+            if fields is None:
+                self._conn.execute("DELETE FROM fsm_data WHERE key = ?", (skey,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fsm_data (key, field, value) VALUES (?, ?, ?)", packed
+            )
+            self._touch(skey, now)
+            self._remember(skey, data)
+            self._purge(now)
+            self._conn.commit()
+
+    def _key_lock(self, skey: str) -> asyncio.Lock:
+        lock = self._key_locks.get(skey)
+        if lock is None:
+            lock = self._key_locks[skey] = asyncio.Lock()
+        return lock
+
+    # --- интерфейс BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self._set_state_sync, _key_to_str(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await asyncio.to_thread(self._get_state_sync, _key_to_str(key))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        skey = _key_to_str(key)
+        async with self._key_lock(skey):
+            await asyncio.to_thread(self._write_sync, skey, dict(data), None)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        data = await asyncio.to_thread(self._load_sync, _key_to_str(key))
+        return data.copy()
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict[str, Any]:
+        skey = _key_to_str(key)
+        async with self._key_lock(skey):
+            current = dict(await asyncio.to_thread(self._load_sync, skey))
+            current.update(data)
+            await asyncio.to_thread(self._write_sync, skey, current, list(data))
+        return current.copy()
+
+    async def close(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._conn.close()
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import os
+import secrets
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+from config import (
+    METRICS_HOST,
+    SUPERVISOR_BASE_PORT,
+    SUPERVISOR_WORKERS,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+    WEBHOOK_URL,
+)
+from metrics import CONTENT_TYPE, add_label, merge_texts, start_metrics_server
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_BOT_SCRIPT = Path(__file__).resolve().parent / "bot.py"
+
+# Пауза перед перезапуском упавшего воркера; удваивается, если он падает сразу после старта
+_RESTART_DELAY = 1.0
+_RESTART_DELAY_MAX = 30.0
+# Воркер, проработавший дольше, считается стабильным (пауза сбрасывается)
+_STABLE_SECONDS = 60.0
+_HEALTH_TIMEOUT = 2.0
+# Сколько ждём, пока воркеры поднимут свои серверы
+_READY_TIMEOUT = 120.0
+
+
+def route_key(update: dict) -> int:
+    """
+    Ключ маршрутизации обновления — chat_id, а для обновлений без чата (inline-запросы и т.п.)
+    id пользователя. Все обновления одного чата попадают в один воркер.
+    """
+    for payload in update.values():
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return int(user["id"])
+    return 0
+
+
+class Worker:
+    """Процесс бота в режиме webhook на локальном порту."""
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.last_exit: Optional[int] = None
+        self.started_at: Optional[float] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def _env(self) -> dict[str, str]:
+        env = dict(os.environ)
+        # WEBHOOK_URL пустой: вебхук в Telegram регистрирует только супервизор
+        env.update(
+            RUN_MODE="webhook",
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_PORT=str(self.port),
+            WEBHOOK_URL="",
+            # Метрики воркера отдаются на его порту вебхука и собираются супервизором
+            METRICS_PORT="0",
+        )
+        return env
+
+    async def start(self) -> None:
+        self.process = await asyncio.create_subprocess_exec(sys.executable, str(_BOT_SCRIPT), env=self._env())
+        self.started_at = time.monotonic()
+
+
+class Supervisor:
+    """
+    Принимает вебхук Telegram и раздаёт обновления процессам-воркерам по chat_id,
+    поэтому FSM-состояние и фоновые задачи пользователя всегда живут в одном процессе.
+    Упавший воркер перезапускается; /health собирает состояние всех воркеров.
+    """
+
+    def __init__(self, workers: int = SUPERVISOR_WORKERS, base_port: int = SUPERVISOR_BASE_PORT):
+        self.workers = [Worker(index, base_port + index) for index in range(workers)]
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._watchers: list[asyncio.Task] = []
+        self._stopping = False
+
+    def pick(self, update: dict) -> Worker:
+        return self.workers[route_key(update) % len(self.workers)]
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession()
+        self._watchers = [asyncio.create_task(self._watch(worker)) for worker in self.workers]
+
+    async def _watch(self, worker: Worker) -> None:
+        delay = _RESTART_DELAY
+        while not self._stopping:
+            await worker.start()
+            worker.last_exit = await worker.process.wait()
+            if self._stopping:
+                return
+            worker.restarts += 1
+            if time.monotonic() - worker.started_at > _STABLE_SECONDS:
+                delay = _RESTART_DELAY
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RESTART_DELAY_MAX)
+
+    async def wait_ready(self, stop: asyncio.Event, timeout: float = _READY_TIMEOUT) -> bool:
+        """Ждём, пока все воркеры начнут отвечать на /health (или пока не попросят остановиться)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not stop.is_set():
+            reports = await asyncio.gather(*(self._worker_health(worker) for worker in self.workers))
+            if all(report["ok"] for report in reports):
+                return True
+            await asyncio.sleep(0.5)
+        return False
+
+    async def stop(self) -> None:
+        """SIGTERM воркерам (они дообрабатывают принятые обновления), по таймауту — kill."""
+        self._stopping = True
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.terminate()
+        _, pending = await asyncio.wait(self._watchers, timeout=WEBHOOK_SHUTDOWN_TIMEOUT + 5)
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.kill()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        worker = self.pick(update)
+        headers = {"Content-Type": "application/json"}
+        if WEBHOOK_SECRET:
+            headers[SECRET_HEADER] = WEBHOOK_SECRET
+        try:
+            async with self._session.post(worker.url + WEBHOOK_PATH, data=body, headers=headers) as resp:
+                return web.Response(status=resp.status, body=await resp.read(), content_type=resp.content_type)
+        except aiohttp.ClientError:
+            # Воркер перезапускается: Telegram повторит доставку обновления позже
+            return web.Response(status=503)
+
+    async def _worker_health(self, worker: Worker) -> dict:
+        report = {
+            "index": worker.index,
+            "port": worker.port,
+            "pid": worker.process.pid if worker.process else None,
+            "restarts": worker.restarts,
+            "last_exit": worker.last_exit,
+            "ok": False,
+        }
+        if not worker.alive:
+            return report
+        try:
+            timeout = aiohttp.ClientTimeout(total=_HEALTH_TIMEOUT)
+            async with self._session.get(worker.url + "/health", timeout=timeout) as resp:
+                resp.raise_for_status()
+                report["health"] = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            report["error"] = str(exc) or type(exc).__name__
+            return report
+        report["ok"] = True
+        return report
+
+    async def _worker_metrics(self, worker: Worker) -> str:
+        if not worker.alive:
+            return ""
+        try:
+            timeout = aiohttp.ClientTimeout(total=_HEALTH_TIMEOUT)
+            async with self._session.get(worker.url + "/metrics", timeout=timeout) as resp:
+                resp.raise_for_status()
+                return add_label(await resp.text(), "worker", str(worker.index))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return ""
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Метрики всех воркеров с меткой worker="<номер>"."""
+        texts = await asyncio.gather(*(self._worker_metrics(worker) for worker in self.workers))
+        return web.Response(body=merge_texts(texts).encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        reports = await asyncio.gather(*(self._worker_health(worker) for worker in self.workers))
+        healthy = sum(report["ok"] for report in reports)
+        jobs = {"queued": 0, "running": 0}
+        for report in reports:
+            for key, value in report.get("health", {}).get("jobs", {}).items():
+                jobs[key] = jobs.get(key, 0) + value
+        body = {
+            "status": "ok" if healthy == len(reports) else "degraded" if healthy else "down",
+            "workers": reports,
+            "jobs": jobs,
+        }
+        return web.json_response(body, status=200 if healthy == len(reports) else 503)
+
+
+async def run_supervisor(bot: Bot, allowed_updates: list[str], stop: asyncio.Event, metrics_port: int = 0) -> None:
+    """
+    Режим supervisor: SUPERVISOR_WORKERS процессов бота (каждый — webhook на своём локальном порту)
+    и общий вход на WEBHOOK_HOST:WEBHOOK_PORT, который маршрутизирует обновления по chat_id.
+    Вебхук в Telegram регистрируется, когда все воркеры готовы.
+    """
+    supervisor = Supervisor()
+    await supervisor.start()
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, supervisor.handle_update)
+    app.router.add_get("/health", supervisor.handle_health)
+    app.router.add_get("/metrics", supervisor.handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    metrics_runner = None
+    try:
+        await supervisor.wait_ready(stop)
+        if stop.is_set():
+            return
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        if metrics_port:
+            metrics_runner = await start_metrics_server(METRICS_HOST, metrics_port, supervisor.handle_metrics)
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=allowed_updates,
+            )
+        await stop.wait()
+    finally:
+        # Сначала перестаём принимать обновления, затем останавливаем воркеры
+        for site in list(runner.sites):
+            await site.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await supervisor.stop()
+        await runner.cleanup()
+        await bot.session.close()
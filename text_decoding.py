@@ -0,0 +1,120 @@
+import codecs
+import io
+import re
+from typing import BinaryIO, Optional, Union
+
+# Сколько байт из начала файла анализируем для определения кодировки
+SNIFF_BYTES = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# Байты букв кириллицы в cp1251: А..я (0xC0-0xFF), Ё (0xA8), ё (0xB8) -> "C", остальные -> "."
+_CYRILLIC_MAP = bytes(
+    ord("C") if b >= 0xC0 or b in (0xA8, 0xB8) else ord(".") for b in range(256)
+)
+
+_NON_ASCII_RE = re.compile(rb"[\x80-\xff]")
+
+# 0x98 — единственный байт, не определённый в cp1251
+_CP1251_UNDEFINED = b"\x98"
+
+TextSource = Union[bytes, bytearray, memoryview, BinaryIO]
+
+
+def _is_utf8_prefix(prefix: bytes) -> bool:
+    """Проверяем, что префикс — корректный UTF-8 (оборванный в конце символ допускается)."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        decoder.decode(prefix, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _looks_cyrillic(prefix: bytes) -> bool:
+    """
+    Кириллица в cp1251 идёт «словами» из старших байт подряд, а латинские буквы с диакритикой
+    в latin-1 обычно стоят поодиночке среди ASCII. Считаем, что это cp1251, если хотя бы
+    половина «кириллических» байт стоит парами.
+    """
+    marks = prefix.translate(_CYRILLIC_MAP)
+    letters = marks.count(b"C")
+    if not letters:
+        return False
+    paired = marks.count(b"CC") * 2
+    return paired * 2 >= letters
+
+
+def detect_encoding(raw: bytes) -> str:
+    """
+    Определяем кодировку по BOM, корректности UTF-8 и статистике кириллицы.
+    Анализируем не больше SNIFF_BYTES байт, начиная с первого не-ASCII байта: в больших CSV
+    первые мегабайты бывают чисто английскими, и по ним кодировку не отличить.
+    """
+    for bom, encoding in _BOMS:
+        if raw[: len(bom)] == bom:
+            return encoding
+    first = _NON_ASCII_RE.search(raw)
+    if first is None:
+        return "utf-8"
+    window = bytes(raw[first.start() : first.start() + SNIFF_BYTES])
+    if _is_utf8_prefix(window):
+        return "utf-8"
+    if _CP1251_UNDEFINED not in window and _looks_cyrillic(window):
+        return "cp1251"
+    return "latin-1"
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Бинарный поток: сначала уже прочитанный префикс, затем остаток исходного потока."""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self._prefix = memoryview(prefix)
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        chunk = self._stream.read(len(buffer))
+        if not chunk:
+            return 0
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def open_text(source: TextSource, encoding: Optional[str] = None) -> io.TextIOWrapper:
+    """
+    Текстовый поток поверх bytes или бинарного файла без декодирования всего содержимого сразу.
+    Кодировка (если не задана явно) определяется по содержимому bytes или по первым
+    SNIFF_BYTES байтам файла.
+    Ошибки декодирования дальше по потоку заменяются символом U+FFFD: вернуться
+    к уже разобранному тексту при потоковом чтении нельзя.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        stream: BinaryIO = io.BytesIO(source)
+        if encoding is None:
+            encoding = detect_encoding(source)
+    elif encoding is None:
+        prefix = source.read(SNIFF_BYTES)
+        encoding = detect_encoding(prefix)
+        if source.seekable():
+            source.seek(-len(prefix), io.SEEK_CUR)
+            stream = source
+        else:
+            stream = io.BufferedReader(_PrefixedReader(prefix, source))
+    else:
+        stream = source
+    # newline="" — переводы строк отдаём как есть (нужно для csv и splitlines)
+    return io.TextIOWrapper(stream, encoding=encoding, errors="replace", newline="")
@@ -0,0 +1,256 @@
+import cProfile
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import (
+    PROFILE_DIR,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_THRESHOLD,
+    PROFILER,
+    TRACE_PATH,
+    TRACE_SAMPLE_RATE,
+    TRACING_ENABLED,
+)
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # pyinstrument — необязательная зависимость
+    PyinstrumentProfiler = None
+
+HAS_PYINSTRUMENT = PyinstrumentProfiler is not None
+
+# Текущий спан задачи: asyncio копирует контекст в создаваемые задачи, поэтому спаны
+# из asyncio.gather и create_task попадают в тот же трейс
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+# cProfile/pyinstrument перехватывают весь поток event loop, поэтому профилируем один запрос за раз
+_profiling = False
+
+
+def _new_id(size: int = 8) -> str:
+    return os.urandom(size).hex()
+
+
+class Span:
+    """Участок обработки запроса: имя, время, атрибуты и ссылка на родителя в том же трейсе."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attrs", "started_at", "_started", "duration", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        self.duration = time.perf_counter() - self._started
+        if exc is not None:
+            self.error = type(exc).__name__ if not str(exc) else f"{type(exc).__name__}: {exc}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.started_at, 6),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class JsonlExporter:
+    """
+    Пишет завершённые спаны в JSONL из фонового потока, чтобы не блокировать event loop.
+    Пачка строк записывается одним write() в файл, открытый с O_APPEND, поэтому
+    несколько процессов (режим supervisor) могут писать в один файл, не перемешивая строки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put(span.to_dict())
+
+    def _run(self) -> None:
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while not self._queue.empty() and batch[-1] is not None:
+                    batch.append(self._queue.get())
+                stop = batch[-1] is None
+                records = [record for record in batch if record is not None]
+                if records:
+                    lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+                    os.write(fd, lines.encode("utf-8"))
+                if stop:
+                    return
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        """Дописываем оставшиеся спаны (вызывается при остановке бота)."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+exporter = JsonlExporter(TRACE_PATH)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, leaf: bool = False, **attrs) -> Iterator[Optional[Span]]:
+    """
+    Вложенный спан текущего трейса; вне трейса (трассировка выключена или запрос не попал
+    в выборку) ничего не делает и отдаёт None.
+    leaf=True — спан не становится текущим: так его можно держать открытым через yield
+    асинхронного генератора, не подменяя контекст вызывающего кода.
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(name, parent.trace_id, parent.span_id, attrs)
+    token = None if leaf else _current.set(current)
+    error: Optional[BaseException] = None
+    try:
+        yield current
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        current.finish(error)
+        if token is not None:
+            _current.reset(token)
+        exporter.export(current)
+
+
+def _start_profiler() -> Any:
+    global _profiling
+    if PROFILE_THRESHOLD <= 0 or _profiling or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if PROFILER == "pyinstrument" and HAS_PYINSTRUMENT:
+        # async_mode: время ожидания в await учитывается в той корутине, которая ждала
+        profiler = PyinstrumentProfiler(async_mode="enabled")
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик
+            return None
+    _profiling = True
+    return profiler
+
+
+def _stop_profiler(profiler: Any, root: Span) -> None:
+    """Останавливаем профилировщик; профиль сохраняем, только если запрос был медленным."""
+    global _profiling
+    is_cprofile = isinstance(profiler, cProfile.Profile)
+    try:
+        if is_cprofile:
+            profiler.disable()
+        else:
+            profiler.stop()
+        if root.duration is None or root.duration < PROFILE_THRESHOLD:
+            return
+        directory = Path(PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        if is_cprofile:
+            # Смотреть: python -m pstats <файл> или snakeviz
+            path = directory / f"{root.trace_id}-{root.name}.prof"
+            profiler.dump_stats(str(path))
+        else:
+            path = directory / f"{root.trace_id}-{root.name}.html"
+            path.write_text(profiler.output_html(), encoding="utf-8")
+        root.set(profile=str(path))
+    finally:
+        _profiling = False
+
+
+@contextmanager
+def trace(name: str, parent: Optional[Span] = None, **attrs) -> Iterator[Optional[Span]]:
+    """
+    Корневой спан запроса. С parent — продолжение уже начатого трейса (например, фоновая
+    генерация после /generate). Без parent новый трейс попадает в выборку с вероятностью
+    TRACE_SAMPLE_RATE. Часть трейсов (PROFILE_SAMPLE_RATE) выполняется под профилировщиком,
+    и если запрос длился дольше PROFILE_THRESHOLD секунд, профиль сохраняется в PROFILE_DIR.
+    """
+    if not TRACING_ENABLED or (parent is None and random.random() >= TRACE_SAMPLE_RATE):
+        yield None
+        return
+    root = Span(name, parent.trace_id if parent else _new_id(16), parent.span_id if parent else None, attrs)
+    token = _current.set(root)
+    profiler = _start_profiler()
+    error: Optional[BaseException] = None
+    try:
+        yield root
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        root.finish(error)
+        _current.reset(token)
+        if profiler is not None:
+            _stop_profiler(profiler, root)
+        exporter.export(root)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Трейс на каждое обновление (outer-middleware dp.update, после определения чата)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        attrs: dict[str, Any] = {}
+        if isinstance(event, Update):
+            attrs["update_id"] = event.update_id
+            attrs["type"] = event.event_type
+        chat = data.get("event_chat")
+        if chat is not None:
+            attrs["chat_id"] = chat.id
+        with trace("update", **attrs):
+            return await handler(event, data)
+
+
+def close_tracing() -> None:
+    exporter.close()
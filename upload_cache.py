@@ -0,0 +1,93 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import UPLOAD_CACHE_MAX_BYTES
+from dataset import ExerciseDataset
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+class UploadCache:
+    """
+    Кэш разобранных загрузок в памяти.
+    Основной ключ — (тип файла, sha256 содержимого), поэтому одинаковые книги от разных
+    пользователей разбираются один раз. Дополнительный индекс по file_unique_id из Telegram
+    позволяет не скачивать уже известный файл повторно.
+    Вытеснение — LRU по суммарному размеру исходных файлов (max_bytes).
+    """
+
+    def __init__(self, max_bytes: int = UPLOAD_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], tuple[Any, int]] = OrderedDict()
+        self._file_ids: dict[tuple[str, str], tuple[str, str]] = {}
+        self._size = 0
+
+    @staticmethod
+    def _share(value: Any) -> Any:
+        # Датасет в /generate дополняется на месте, поэтому каждому пользователю — своя копия.
+        # Вокабуляр только читается и может быть общим.
+        if isinstance(value, ExerciseDataset):
+            return value.copy()
+        return value
+
+    def _lookup(self, key: Optional[tuple[str, str]], count_miss: bool = True) -> Any:
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            if count_miss:
+                self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._share(entry[0])
+
+    def get_by_file_id(self, kind: str, file_unique_id: str) -> Any:
+        """Разобранный файл по file_unique_id (None — файл нужно скачать)."""
+        # Промах здесь не считаем: дальше будет поиск по хэшу содержимого
+        return self._lookup(self._file_ids.get((kind, file_unique_id)), count_miss=False)
+
+    def get_by_hash(self, kind: str, digest: str, file_unique_id: Optional[str] = None) -> Any:
+        """Разобранный файл по хэшу содержимого; заодно запоминаем file_unique_id."""
+        key = (kind, digest)
+        value = self._lookup(key)
+        if value is not None and file_unique_id:
+            self._file_ids[(kind, file_unique_id)] = key
+        return value
+
+    def put(self, kind: str, digest: str, value: Any, size: int, file_unique_id: Optional[str] = None) -> None:
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return
+        key = (kind, digest)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old[1]
+        # Храним собственную копию: вызывающий код дальше работает со своим экземпляром
+        self._entries[key] = (self._share(value), size)
+        self._size += size
+        if file_unique_id:
+            self._file_ids[(kind, file_unique_id)] = key
+        self._evict()
+
+    def _evict(self) -> None:
+        evicted = set()
+        while self._size > self.max_bytes and self._entries:
+            key, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            evicted.add(key)
+        if evicted:
+            self._file_ids = {fid: key for fid, key in self._file_ids.items() if key not in evicted}
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+
+upload_cache = UploadCache()
@@ -1,26 +1,129 @@
+import io
 import re
-
-
-VOCAB_SECTION_PATTERNS = [
-    re.compile(r"\bVOCABULARY\b", re.IGNORECASE),
-    re.compile(r"\bWORD\s+LIST\b", re.IGNORECASE),
-]
-
-
-def _find_vocab_section(text: str) -> str:
-    """Ищем начало раздела вокабуляра и возвращаем текст с этого места."""
-    for pattern in VOCAB_SECTION_PATTERNS:
-        match = None
-        for m in pattern.finditer(text):
-            match = m
-        if match:
-            return text[match.start():]
-    return ""
-
-
-def parse_vocabulary(text: str) -> dict:
+from typing import IO, Iterable, Iterator, Optional, Union
+
+from text_decoding import open_text
+
+
+# Все шаблоны компилируются один раз при импорте модуля
+_SECTION_MARKER_RE = re.compile(r"\b(?:(VOCABULARY)|WORD\s+LIST)\b", re.IGNORECASE)
+_HEADER_RE = re.compile(
+    r"^\s*(?:UNIT\s+(?P<unit>\d+)|Module\s+(?P<module>[0-9]+[a-z]?))\b", re.IGNORECASE
+)
+_PAGE_MARKER_RE = re.compile(r"^\s*-{2,}\s*PAGE\s+\d+\s*-{2,}\s*$", re.IGNORECASE)
+_SKIP_PREFIXES = ("unit ", "module ", "spotlight", "the town mouse")
+
+# Размер блока чтения (символов)
+_BLOCK_CHARS = 1 << 20
+
+# Приоритет начала раздела: весь текст < последний "WORD LIST" < последний "VOCABULARY"
+_SECTION_NONE = 0
+_SECTION_WORD_LIST = 1
+_SECTION_VOCABULARY = 2
+
+VocabularySource = Union[str, bytes, IO[str], IO[bytes]]
+
+
+class _VocabularyBuilder:
+    """Состояние разбора одного раздела вокабуляра."""
+
+    __slots__ = ("units", "unit_words", "order_units", "order_modules", "current_unit", "current_module")
+
+    def __init__(self):
+        self.units: dict[str, dict[str, list[str]]] = {}
+        self.unit_words: dict[str, list[str]] = {}
+        # dict вместо list: проверка «уже встречался» за O(1), порядок вставки сохраняется
+        self.order_units: dict[str, None] = {}
+        self.order_modules: dict[str, None] = {}
+        self.current_unit = None
+        self.current_module = None
+
+    def feed(self, lines: Iterable[str]) -> None:
+        """Разбираем пачку строк (цикл на локальных переменных — это самый горячий участок)."""
+        units = self.units
+        unit_words = self.unit_words
+        current_unit = self.current_unit
+        current_module = self.current_module
+        header_match = _HEADER_RE.match
+        page_match = _PAGE_MARKER_RE.match
+        extract = _extract_word_from_line
+
+        for raw_line in lines:
+            line = raw_line.strip()
+            if not line:
+                continue
+
+            # Заголовки начинаются с "Unit"/"Module" — regex запускаем только для таких строк
+            header = header_match(line) if line[0] in "uUmM" else None
+            if header:
+                unit_num = header.group("unit")
+                if unit_num is not None:
+                    current_unit = f"UNIT {unit_num}"
+                    units.setdefault(current_unit, {})
+                    unit_words.setdefault(current_unit, [])
+                    self.order_units[current_unit] = None
+                    continue
+                current_module = f"Module {header.group('module')}"
+                self.order_modules[current_module] = None
+                if current_unit:
+                    units[current_unit].setdefault(current_module, [])
+                continue
+
+            if not current_unit or page_match(line):
+                continue
+            word = extract(line)
+            if word:
+                unit_words[current_unit].append(word)
+                if current_module:
+                    units[current_unit].setdefault(current_module, []).append(word)
+
+        self.current_unit = current_unit
+        self.current_module = current_module
+
+    def result(self) -> dict:
+        return {
+            "units": self.units,
+            "unit_words": self.unit_words,
+            "order_units": list(self.order_units),
+            "order_modules": list(self.order_modules),
+        }
+
+
+def _iter_blocks(source: VocabularySource, encoding: Optional[str]) -> Iterator[list[str]]:
+    """
+    Читаем str, bytes или файловый объект блоками по _BLOCK_CHARS символов и отдаём списки
+    целых строк (с переводами строк): документ целиком не разбивается на строки заранее.
+    """
+    if isinstance(source, str):
+        stream: IO[str] = io.StringIO(source)
+    elif isinstance(source, io.TextIOBase):
+        stream = source
+    else:
+        # bytes и бинарные файлы декодируются потоково (кодировка определяется по началу файла)
+        stream = open_text(source, encoding)
+
+    carry = ""
+    while True:
+        block = stream.read(_BLOCK_CHARS)
+        if not block:
+            break
+        # splitlines учитывает и редкие разделители строк (\v, \f, \x85, ...), как str.splitlines.
+        # Последний кусок может быть неполной строкой (или "\r" перед "\n") — переносим его в следующий блок
+        lines = (carry + block).splitlines(True)
+        carry = lines.pop()
+        if lines:
+            yield lines
+    if carry:
+        yield [carry]
+
+
+def parse_vocabulary(source: VocabularySource, encoding: Optional[str] = None) -> dict:
     """
-    Парсим вокабуляр по Unit/Module.
+    Парсим вокабуляр по Unit/Module за один проход по строкам.
+    source — str, bytes или файловый объект (текстовый или бинарный). Байты декодируются в encoding,
+    а если она не задана — в кодировке, определённой по началу файла (см. text_decoding).
+    Разбор начинается с последнего заголовка "VOCABULARY" (если его нет — с последнего "WORD LIST",
+    иначе с начала текста): при встрече такого заголовка состояние разбора сбрасывается.
     Возвращаем структуру:
     {
         "units": { "UNIT 1": { "Module 1": [..], ... }, ... },
@@ -29,63 +132,38 @@ def parse_vocabulary(text: str) -> dict:
         "order_modules": ["Module 1", ...]
     }
     """
-    section = _find_vocab_section(text) or text
-
-    unit_re = re.compile(r"^\s*UNIT\s+(\d+)\b", re.IGNORECASE)
-    unit_title_re = re.compile(r"^\s*Unit\s+(\d+)\b", re.IGNORECASE)
-    module_re = re.compile(r"^\s*Module\s+([0-9]+[a-z]?)\b", re.IGNORECASE)
-    page_marker_re = re.compile(r"^\s*-{2,}\s*PAGE\s+\d+\s*-{2,}\s*$", re.IGNORECASE)
-
-    units: dict[str, dict[str, list[str]]] = {}
-    unit_words: dict[str, list[str]] = {}
-    order_units: list[str] = []
-    order_modules: list[str] = []
+    builder = _VocabularyBuilder()
+    section = _SECTION_NONE
 
-    current_unit = None
-    current_module = None
-
-    for raw_line in section.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
-        if page_marker_re.match(line):
-            continue
-
-        unit_match = unit_re.match(line) or unit_title_re.match(line)
-        if unit_match:
-            unit_num = unit_match.group(1)
-            current_unit = f"UNIT {unit_num}"
-            units.setdefault(current_unit, {})
-            unit_words.setdefault(current_unit, [])
-            if current_unit not in order_units:
-                order_units.append(current_unit)
-            continue
-
-        module_match = module_re.match(line)
-        if module_match:
-            module_code = module_match.group(1)
-            current_module = f"Module {module_code}"
-            if current_module not in order_modules:
-                order_modules.append(current_module)
-            if current_unit:
-                units[current_unit].setdefault(current_module, [])
+    for lines in _iter_blocks(source, encoding):
+        # Маркеры раздела редки: построчный поиск нужен только в блоках, где они вообще есть
+        if not _SECTION_MARKER_RE.search("".join(lines)):
+            builder.feed(lines)
             continue
-
-        word = _extract_word_from_line(line)
-        if word and current_unit:
-            unit_words.setdefault(current_unit, []).append(word)
-            if current_module:
-                units[current_unit].setdefault(current_module, []).append(word)
-
-    if not unit_words:
+        pending = 0
+        for idx, line in enumerate(lines):
+            marker = _SECTION_MARKER_RE.search(line)
+            if not marker:
+                continue
+            start = None
+            for m in _SECTION_MARKER_RE.finditer(line, marker.start()):
+                if m.group(1):
+                    section = _SECTION_VOCABULARY
+                    start = m.start()
+                elif section <= _SECTION_WORD_LIST:
+                    section = _SECTION_WORD_LIST
+                    start = m.start()
+            if start is not None:
+                # Раздел начинается с позиции заголовка внутри строки: всё до него отбрасываем
+                builder = _VocabularyBuilder()
+                lines[idx] = line[start:]
+                pending = idx
+        builder.feed(lines[pending:])
+
+    if not builder.unit_words:
         raise ValueError("Не удалось распознать юниты и слова в файле вокабуляра.")
 
-    return {
-        "units": units,
-        "unit_words": unit_words,
-        "order_units": order_units,
-        "order_modules": order_modules,
-    }
+    return builder.result()
 
 
 def get_words_for_unit(vocab: dict, unit: str) -> list[str]:
@@ -105,17 +183,15 @@ def get_all_words(vocab: dict, limit: int | None = None) -> list[str]:
 
 def _extract_word_from_line(line: str) -> str | None:
     """Извлекаем слово/фразу из строки вида 'word /phonetic/ translation'."""
-    lowered = line.lower()
-    if lowered.startswith(("unit ", "module ", "spotlight", "the town mouse")):
+    slash = line.find("/")
+    if slash < 0:
         return None
     if line.startswith("-"):
         return None
-    if "/" not in line:
-        return None
-    match = re.match(r"^(.*?)\s*/", line)
-    if not match:
+    if line[:14].lower().startswith(_SKIP_PREFIXES):
         return None
-    word = match.group(1).strip()
+    # Всё до первого "/" (без regex: эта функция вызывается для каждой строки файла)
+    word = line[:slash].strip()
     if not word:
         return None
     return word
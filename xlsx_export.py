@@ -0,0 +1,119 @@
+import os
+import tempfile
+from io import BytesIO
+from typing import BinaryIO, Optional, Union
+
+from config import XLSX_SPOOL_ROWS
+from dataset import ExerciseDataset, as_dataset
+from metrics import xlsx_build_seconds
+
+BASE_FIELDS = ["instruction", "page_num", "pred_label"]
+
+# Результат экспорта: bytes в памяти или путь к временному файлу (его нужно удалить после отправки)
+ExportResult = Union[bytes, str]
+
+
+def _write_only_workbook():
+    try:
+        from openpyxl import Workbook
+    except ImportError as exc:
+        raise RuntimeError("Для записи .xlsx нужен пакет openpyxl.") from exc
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    return wb, ws
+
+
+def _fieldnames(has_unit: bool) -> list[str]:
+    return BASE_FIELDS + ["unit"] if has_unit else list(BASE_FIELDS)
+
+
+def render_xlsx(dataset: ExerciseDataset, output: BinaryIO) -> None:
+    """Пишем XLSX в output потоково (write-only лист не держит объекты ячеек в памяти)."""
+    fieldnames = _fieldnames(dataset.has_unit and len(dataset) > 0)
+    wb, ws = _write_only_workbook()
+    ws.append(fieldnames)
+    for values in dataset.iter_values(fieldnames):
+        ws.append(values)
+    wb.save(output)
+
+
+def render_xlsx_pair(
+    dataset: ExerciseDataset,
+    generated_start: int,
+    full_output: BinaryIO,
+    generated_output: Optional[BinaryIO],
+) -> None:
+    """
+    За один проход по датасету пишем два файла: полный датасет и только сгенерированные строки
+    (начиная с generated_start). Сгенерированные строки всегда содержат unit.
+    """
+    has_generated = generated_start < len(dataset)
+    full_fields = _fieldnames(dataset.has_unit and len(dataset) > 0)
+    gen_fields = _fieldnames(True)
+    # Поля сгенерированного файла — префикс полей полного (unit в полном файле есть всегда,
+    # когда есть сгенерированные строки), поэтому значения строки формируются один раз
+    gen_width = len(gen_fields)
+
+    full_wb, full_ws = _write_only_workbook()
+    full_ws.append(full_fields)
+    gen_wb = gen_ws = None
+    if has_generated and generated_output is not None:
+        gen_wb, gen_ws = _write_only_workbook()
+        gen_ws.append(gen_fields)
+
+    for idx, values in enumerate(dataset.iter_values(full_fields)):
+        full_ws.append(values)
+        if gen_ws is not None and idx >= generated_start:
+            gen_ws.append(values[:gen_width])
+
+    full_wb.save(full_output)
+    if gen_wb is not None:
+        gen_wb.save(generated_output)
+
+
+def build_xlsx_bytes(rows) -> bytes:
+    """Собираем XLSX из датасета или списка словарей."""
+    output = BytesIO()
+    with xlsx_build_seconds.time(kind="single"):
+        render_xlsx(as_dataset(rows), output)
+    return output.getvalue()
+
+
+def _open_output(spool: bool) -> BinaryIO:
+    if spool:
+        return tempfile.NamedTemporaryFile(prefix="exercises_", suffix=".xlsx", delete=False)
+    return BytesIO()
+
+
+def _close_output(output: BinaryIO) -> ExportResult:
+    if isinstance(output, BytesIO):
+        return output.getvalue()
+    output.close()
+    return output.name
+
+
+def export_xlsx_pair(
+    dataset: ExerciseDataset, generated_start: int, spool_rows: int = XLSX_SPOOL_ROWS
+) -> tuple[ExportResult, Optional[ExportResult]]:
+    """
+    Экспортируем полный и сгенерированный датасеты.
+    Если строк больше spool_rows, файлы пишутся во временные файлы на диске
+    и вместо bytes возвращаются пути к ним. Второй элемент — None, если сгенерированных строк нет.
+    """
+    spool = bool(spool_rows) and len(dataset) > spool_rows
+    has_generated = generated_start < len(dataset)
+    full_output = _open_output(spool)
+    gen_output = _open_output(spool) if has_generated else None
+    try:
+        # В процессном пуле замер остаётся в дочернем процессе; этап целиком меряет bot (stage="xlsx")
+        with xlsx_build_seconds.time(kind="pair"):
+            render_xlsx_pair(dataset, generated_start, full_output, gen_output)
+    except Exception:
+        for output in (full_output, gen_output):
+            if output is not None and not isinstance(output, BytesIO):
+                output.close()
+                os.unlink(output.name)
+        raise
+    full = _close_output(full_output)
+    generated = _close_output(gen_output) if gen_output is not None else None
+    return full, generated